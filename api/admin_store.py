@@ -0,0 +1,161 @@
+# api/admin_store.py
+# 上帝模式用的 Session / 報告索引：
+# 以 sorted set 記錄 key (score = 最後活動 / 建立時間)，列表用 cursor 分頁、TTL 用 pipeline 一次取，
+# 清除改用 SCAN + UNLINK 分批，不再用 KEYS 卡住整個 Redis。
+# 回報內容以 zlib 壓縮後存放；Session Log 存精簡的 JSON 欄位，只在上帝模式讀取時才排版成文字。
+
+import json
+import time
+import zlib
+from functools import lru_cache
+
+SESSION_INDEX = "idx:sessions"
+REPORT_INDEX = "idx:reports"
+SESSION_TTL = 86400
+REPORT_TTL = 604800
+SCAN_BATCH = 500
+
+# 回報 = REPORT_MAGIC + zlib(JSON)；沒有 magic 的是舊版純 JSON
+REPORT_MAGIC = b"z1|"
+LOG_INDENT = " " * 17
+_TW_OFFSET = 8 * 3600
+
+
+def list_indexed(r, index_key, prefix, max_age, cursor=None, limit=100):
+    """
+    依 score 由新到舊列出 (同分時 member 由大到小，同 Redis ZREVRANGEBYSCORE)。
+    cursor 為上一頁最後一筆的 "score:member"，同分的 member 跨頁也不會漏掉。
+    回傳 ([(id, score, ttl), ...], next_cursor)；已過期的 key 順手從索引移除。
+    """
+    # 超過 TTL 的一定已經過期，先整段清掉
+    r.zremrangebyscore(index_key, "-inf", time.time() - max_age)
+    max_score, offset = "+inf", 0
+    if cursor:
+        max_score, _, last = cursor.partition(":")
+        # 同分的 member 中，大於等於上一頁最後一筆的都已經列過 (舊格式只有 score：整組同分都跳過)
+        last = last.encode('utf-8')
+        offset = sum(1 for m in r.zrevrangebyscore(index_key, max_score, max_score) if m >= last)
+    members = r.zrevrangebyscore(index_key, max_score, "-inf", start=offset, num=limit, withscores=True)
+    if not members: return ([], None)
+
+    pipe = r.pipeline(transaction=False)
+    for m, _ in members: pipe.ttl(prefix + m.decode('utf-8'))
+    ttls = pipe.execute()
+
+    items, expired = [], []
+    for (m, score), ttl in zip(members, ttls):
+        if ttl == -2:
+            expired.append(m)
+            continue
+        items.append((m.decode('utf-8'), score, ttl))
+    if expired: r.zrem(index_key, *expired)
+
+    last_member, last_score = members[-1]
+    next_cursor = f"{last_score!r}:{last_member.decode('utf-8')}" if len(members) == limit else None
+    return (items, next_cursor)
+
+
+def clear_prefix(r, prefix, index_key):
+    """SCAN + UNLINK 分批刪除，回傳刪除數量"""
+    deleted = 0
+    for batch in _scan_batches(r, prefix + "*"):
+        deleted += r.unlink(*batch)
+    r.unlink(index_key)
+    return deleted
+
+
+def rebuild_index(r, prefix, index_key, max_age):
+    """把索引建立前就存在的 key 補進索引；score 由剩餘 TTL 反推"""
+    now = time.time()
+    added = 0
+    for batch in _scan_batches(r, prefix + "*"):
+        pipe = r.pipeline(transaction=False)
+        for k in batch: pipe.ttl(k)
+        ttls = pipe.execute()
+        mapping = {}
+        for k, ttl in zip(batch, ttls):
+            if ttl == -2: continue
+            elapsed = max_age - ttl if ttl > 0 else 0
+            mapping[k.decode('utf-8')[len(prefix):]] = now - elapsed
+        if mapping: added += r.zadd(index_key, mapping)
+    return added
+
+
+def _scan_batches(r, pattern):
+    batch = []
+    for k in r.scan_iter(match=pattern, count=SCAN_BATCH):
+        batch.append(k)
+        if len(batch) >= SCAN_BATCH:
+            yield batch
+            batch = []
+    if batch: yield batch
+
+
+def encode_report(data):
+    return REPORT_MAGIC + zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_report(blob):
+    if blob.startswith(REPORT_MAGIC): blob = zlib.decompress(blob[len(REPORT_MAGIC):])
+    return json.loads(blob)
+
+
+def encode_log_entry(entry):
+    """
+    entry 欄位：t 時間戳、a 動作、r [[起站, 迄站, 班次數或錯誤], ...]、v3 / v2 資料來源、
+    b / h 車站看板的站名與時數、x 全域 Log 已關閉
+    """
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+@lru_cache(maxsize=64)
+def _log_date(day):
+    """第 day 天 (台灣時間，自 epoch 起算) 的 "MM/DD "；lru_cache 多執行緒共用也不會壞掉，不必自己清"""
+    return time.strftime("%m/%d ", time.gmtime(day * 86400))
+
+
+def _log_time(ts):
+    """台灣時間的 "MM/DD HH:MM:SS"；日期部分每天只算一次，不必每筆都建 datetime"""
+    day, sec = divmod(int(ts) + _TW_OFFSET, 86400)
+    date = _log_date(day)
+    m, s = divmod(sec, 60)
+    h, m = divmod(m, 60)
+    return f"{date}{h:02d}:{m:02d}:{s:02d}"
+
+
+def _outcome(n):
+    return f"{n} trains" if isinstance(n, int) else n
+
+
+def _format_log(e):
+    when = _log_time(e["t"])
+    routes = e.get("r", [])
+    if "b" in e:
+        lines = [f"[{when}] Action: {e['a']}", f"{e['b']} ({e['h']:g}h)",
+                 f"V3 {e['v3']} / V2 {e['v2']}", f"Result: {_outcome(e['n'])}"]
+    elif e["a"] == "Batch":
+        lines = [f"[{when}] Action: Batch ({len(routes)} routes)"]
+        lines += [f"{start} -> {end}: {_outcome(n)}" for start, end, n in routes]
+        lines.append(f"V2 {e['v2']}")
+    else:
+        start, end, n = routes[0]
+        lines = [f"[{when}] Action: {e['a']}", f"{start} -> {end}",
+                 f"V3 {e['v3']} / V2 {e['v2']}", f"Result: {_outcome(n)}"]
+    if e.get("x"): lines.append("[System] Logging stopped (Config OFF)")
+    return ("\n" + LOG_INDENT).join(lines)
+
+
+def render_log_entry(raw):
+    """排版成上帝模式顯示的文字；舊版直接存文字的原樣回傳"""
+    text = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+    if not text.startswith("{"): return text
+    return _format_log(json.loads(text))
+
+
+def render_log_entries(raws):
+    """整串 LRANGE 結果一起排版：JSON 的條目串成一個陣列只 parse 一次，比逐筆 json.loads 快"""
+    texts = [raw.decode('utf-8') if isinstance(raw, bytes) else raw for raw in raws]
+    compact = [t for t in texts if t.startswith("{")]
+    if not compact: return texts
+    parsed = iter(json.loads("[" + ",".join(compact) + "]"))
+    return [_format_log(next(parsed)) if t.startswith("{") else t for t in texts]
@@ -0,0 +1,316 @@
+# api/cache.py
+# 快取工具：
+# 1. Redis 單飛機制 (single-flight)：快取過期的瞬間，只讓一個 invocation 拿到短租約去打 TDX，其餘的先等新值，
+#    等不到就回舊值 (stale)，真的都沒有才自己打。
+# 2. 兩層快取 swr_get (見下方)
+# 3. cache_only 區塊：快取命中就地回傳，需要同步打上游時丟出 NeedsUpstream，由呼叫端改丟到 thread pool
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+SF_STATS_KEY = "stats:singleflight"
+
+# 只刪除自己持有的租約，避免租約過期後誤刪別人的
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _count(r, name, role):
+    try: r.hincrby(SF_STATS_KEY, f"{name}:{role}", 1)
+    except: pass
+
+
+def single_flight(r, name, load, refresh, load_stale=None, lease_ms=5000, wait_s=1.5, poll_s=0.1, stats_name=None):
+    """
+    name         -> 租約 key (lock:{name})
+    stats_name   -> 計數用的分類 (預設同 name)；必須是有限的幾種，不能帶日期 / 路線，否則統計 hash 會無限長大
+    load()       -> 快取值或 None (等待期間重複呼叫)
+    refresh()    -> 打上游並寫回快取，回傳新值
+    load_stale() -> 舊值或 None
+    回傳 (value, role)，role 為 leader / coalesced / stale / fallback
+    """
+    if not r: return (refresh(), "leader")
+
+    lock_key = f"lock:{name}"
+    stats_name = stats_name or name
+    token = uuid.uuid4().hex
+    try:
+        acquired = r.set(lock_key, token, nx=True, px=lease_ms)
+    except:
+        return (refresh(), "leader")
+
+    if acquired:
+        try:
+            value = refresh()
+        finally:
+            try: r.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+            except: pass
+        _count(r, stats_name, "leader")
+        return (value, "leader")
+
+    deadline = time.monotonic() + wait_s
+    while time.monotonic() < deadline:
+        time.sleep(poll_s)
+        try: value = load()
+        except: value = None
+        if value is not None:
+            _count(r, stats_name, "coalesced")
+            return (value, "coalesced")
+
+    if load_stale:
+        try: value = load_stale()
+        except: value = None
+        if value is not None:
+            _count(r, stats_name, "stale")
+            return (value, "stale")
+
+    # 持有租約的 invocation 太慢或已經掛掉，自己打
+    _count(r, stats_name, "fallback")
+    return (refresh(), "fallback")
+
+
+def single_flight_stats(r, reset=False):
+    """
+    {name: {role: count}}，供上帝模式查看被合併掉的上游呼叫數
+    reset=True 讀完即清空 (也順便清掉舊版以完整快取 key 計數留下的欄位)
+    """
+    stats = {}
+    for k, v in (r.hgetall(SF_STATS_KEY) or {}).items():
+        name, role = k.decode('utf-8').rsplit(':', 1)
+        stats.setdefault(name, {})[role] = int(v)
+    if reset: r.delete(SF_STATS_KEY)
+    return stats
+
+
+# ================= 兩層快取 (L1 行程內 + L2 Redis) =================
+# 每筆資料帶 soft / hard 兩個到期時間：
+#   soft 之前  -> 直接回傳
+#   soft~hard  -> 先回舊值，背景觸發一次更新 (stale-while-revalidate)
+#   hard 之後  -> 視為 miss，走 single_flight 打上游
+# stale_ttl > 0 時 Redis 多留一段時間：只讀 (loader=None) 或上游失敗時仍可回傳這份過期資料
+
+SWR_MAGIC = b"swr1|"
+
+_cache_only = threading.local()
+
+
+class NeedsUpstream(BaseException):
+    """
+    cache_only 區塊內的 swr_get 沒有可用的快取、必須同步呼叫 loader。
+    繼承 BaseException：一路穿過各層的 except Exception 回到呼叫端。
+    """
+
+
+@contextmanager
+def cache_only():
+    """區塊內 (目前執行緒) 的 swr_get 只回傳快取 (含 stale + 背景更新)，不同步打上游"""
+    _cache_only.active = True
+    try: yield
+    finally: _cache_only.active = False
+
+
+class LocalCache:
+    """行程內 LRU，entry = (value, soft_deadline, hard_deadline)"""
+
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None: return None
+            if entry[2] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, value, soft_deadline, hard_deadline):
+        with self._lock:
+            self._data[key] = (value, soft_deadline, hard_deadline)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheStats:
+    """單一請求的快取命中統計，放進回應的 diagnostics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"l1_hit": 0, "l2_hit": 0, "miss": 0, "stale": 0}
+
+    def add(self, field):
+        with self._lock:
+            self.counts[field] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+local_cache = LocalCache()
+
+_refreshing = set()
+_pending_refreshes = []
+_refresh_lock = threading.Lock()
+
+
+def _encode_envelope(payload, soft_deadline, hard_deadline):
+    return SWR_MAGIC + f"{soft_deadline:.0f}|{hard_deadline:.0f}|".encode() + payload
+
+
+def _decode_envelope(blob):
+    """格式不符 (舊版 key) 回傳 None，呼叫端視為 miss"""
+    if not blob or not blob.startswith(SWR_MAGIC): return None
+    soft, hard, payload = blob[len(SWR_MAGIC):].split(b"|", 2)
+    return (payload, float(soft), float(hard))
+
+
+def _json_encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _json_decode(payload):
+    return json.loads(payload)
+
+
+def _trigger_refresh(key, fn, pending=None):
+    """
+    同一個 key 在同一行程內只會有一個背景更新。
+    pending 為觸發這次更新的請求自己的清單 (由該請求的 drain_refreshes 等待)，沒給就記在全域清單。
+    """
+    with _refresh_lock:
+        if key in _refreshing: return
+        _refreshing.add(key)
+
+    def run():
+        try: fn()
+        except Exception as e: print(f"Refresh Error ({key}): {e}")
+        finally:
+            with _refresh_lock: _refreshing.discard(key)
+
+    t = threading.Thread(target=run, daemon=True)
+    with _refresh_lock: (_pending_refreshes if pending is None else pending).append(t)
+    t.start()
+
+
+def drain_refreshes(pending=None, timeout=5.0):
+    """
+    回應送出後呼叫：Serverless 在 handler 結束後會凍結，背景更新要在這之前做完。
+    只等 pending (這個請求觸發的) 更新；自架多執行緒時不會被別的請求觸發的更新拖住。
+    """
+    if pending is None: pending = _pending_refreshes
+    with _refresh_lock:
+        threads = list(pending)
+        pending.clear()
+    deadline = time.monotonic() + timeout
+    for t in threads:
+        t.join(max(0, deadline - time.monotonic()))
+
+
+def swr_get(r, key, loader, soft_ttl, hard_ttl, stats=None, l1=None,
+            encode=_json_encode, decode=_json_decode, lease_ms=5000, stale_ttl=0, pending=None, kind="swr"):
+    """
+    loader() -> 上游新值；傳 None 表示只讀快取，不打上游也不觸發更新
+    kind     -> single_flight 統計用的分類 (route / daily / delay)，key 本身帶日期不能拿來當統計欄位
+    pending  -> 背景更新的 thread 記在這裡 (見 drain_refreshes)
+    回傳 (value, source)，source 為 L1 / L2 / stale / leader / coalesced / fallback / miss
+    """
+    l1 = l1 if l1 is not None else local_cache
+    now = time.time()
+
+    def store(value):
+        soft_deadline, hard_deadline = time.time() + soft_ttl, time.time() + hard_ttl
+        l1.set(key, value, soft_deadline, hard_deadline)
+        if r:
+            try: r.set(key, _encode_envelope(encode(value), soft_deadline, hard_deadline), ex=hard_ttl + stale_ttl)
+            except: pass
+        return value
+
+    def refresh():
+        return store(loader())
+
+    def background_refresh():
+        # 別的 instance 已經更新過 L2 就直接拿來用
+        try: hit = load_l2()
+        except: hit = None
+        if hit and time.time() < hit[1]: return
+
+        # 跨 instance 也只讓一個人更新：拿不到租約就跳過，繼續用舊值
+        lock_key = f"lock:{key}"
+        token = uuid.uuid4().hex
+        if r:
+            try:
+                if not r.set(lock_key, token, nx=True, px=lease_ms): return
+            except: pass
+        try: refresh()
+        finally:
+            if r:
+                try: r.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                except: pass
+
+    def load_l2():
+        if not r: return None
+        env = _decode_envelope(r.get(key))
+        if env is None: return None
+        payload, soft_deadline, hard_deadline = env
+        value = decode(payload)
+        if value is None: return None
+        l1.set(key, value, soft_deadline, hard_deadline)
+        return (value, soft_deadline, hard_deadline)
+
+    entry = l1.get(key)
+    if entry:
+        value, soft_deadline, _ = entry
+        if now < soft_deadline:
+            if stats: stats.add("l1_hit")
+            return (value, "L1")
+        if stats: stats.add("stale")
+        if loader: _trigger_refresh(key, background_refresh, pending)
+        return (value, "stale")
+
+    try: hit = load_l2()
+    except: hit = None
+    expired = None
+    if hit:
+        value, soft_deadline, hard_deadline = hit
+        if now < soft_deadline:
+            if stats: stats.add("l2_hit")
+            return (value, "L2")
+        if now < hard_deadline or not loader:
+            if stats: stats.add("stale")
+            if loader: _trigger_refresh(key, background_refresh, pending)
+            return (value, "stale")
+        # 超過 hard (stale_ttl 期間)：照常同步更新，上游失敗才退回這份
+        expired = value
+
+    if loader and getattr(_cache_only, "active", False): raise NeedsUpstream(key)
+    if stats: stats.add("miss")
+    if not loader: return (None, "miss")
+    def load():
+        hit = load_l2()
+        return hit[0] if hit and time.time() < hit[2] else None
+    try:
+        return single_flight(r, key, load, refresh, lease_ms=lease_ms, stats_name=kind)
+    except Exception:
+        if expired is None: raise
+        return (expired, "stale")
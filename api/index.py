@@ -1,17 +1,45 @@
 from http.server import BaseHTTPRequestHandler
 import json
-import requests
 import os
 import time
+import hashlib
+import math
+import zlib
 import random
+import threading
+from concurrent.futures import Future
 from datetime import datetime, timedelta, timezone
+from operator import itemgetter
 from urllib.parse import parse_qs, urlparse
-import redis
 
 try:
-    from .stations import STATION_MAP
+    from .stations import STATION_MAP, STATION_NAME
+    from .timetable import (build_daily_index, encode_daily_index, decode_daily_index, query_od,
+                            query_departures, normalize_od, encode_route_rows, decode_route_rows)
+    from . import upstream
+    from . import quota
+    from .admin_store import (SESSION_INDEX, REPORT_INDEX, SESSION_TTL, REPORT_TTL, list_indexed, clear_prefix,
+                              rebuild_index, encode_report, decode_report, encode_log_entry, render_log_entries)
+    from .snapshot import (PAST_GRACE_SEC, compile_route, overlay_delays, snapshot_rows, delay_bounds, window_range,
+                           delay_span)
+    from .cache import (single_flight, single_flight_stats, swr_get, drain_refreshes, local_cache,
+                        LocalCache, CacheStats, cache_only, NeedsUpstream)
+    from .metrics import StageTimer, summarize as summarize_metrics
+    from .popularity import record_routes, top_routes
 except ImportError:
-    from stations import STATION_MAP
+    from stations import STATION_MAP, STATION_NAME
+    from timetable import (build_daily_index, encode_daily_index, decode_daily_index, query_od,
+                           query_departures, normalize_od, encode_route_rows, decode_route_rows)
+    import upstream
+    import quota
+    from admin_store import (SESSION_INDEX, REPORT_INDEX, SESSION_TTL, REPORT_TTL, list_indexed, clear_prefix,
+                             rebuild_index, encode_report, decode_report, encode_log_entry, render_log_entries)
+    from snapshot import (PAST_GRACE_SEC, compile_route, overlay_delays, snapshot_rows, delay_bounds, window_range,
+                          delay_span)
+    from cache import (single_flight, single_flight_stats, swr_get, drain_refreshes, local_cache,
+                       LocalCache, CacheStats, cache_only, NeedsUpstream)
+    from metrics import StageTimer, summarize as summarize_metrics
+    from popularity import record_routes, top_routes
 
 # ================= 設定區 =================
 CLIENT_ID = os.environ.get('TDX_ID')
@@ -22,50 +50,169 @@ KV_URL = os.environ.get('UPSTASH_REDIS_KV_URL') or os.environ.get('UPSTASH_REDIS
 ADMIN_USER = os.environ.get('ADMIN_USER')
 ADMIN_PASS = os.environ.get('ADMIN_PASS')
 
-API_BASE_V3 = "https://tdx.transportdata.tw/api/basic/v3/Rail/TRA"
-API_BASE_V2 = "https://tdx.transportdata.tw/api/basic/v2/Rail/TRA"
+# TDX 位址可用環境變數覆寫 (bench/ 的本地假 TDX 伺服器會用到)
+TDX_HOST = os.environ.get('TDX_HOST', 'https://tdx.transportdata.tw')
+API_BASE_V3 = f"{TDX_HOST}/api/basic/v3/Rail/TRA"
+API_BASE_V2 = f"{TDX_HOST}/api/basic/v2/Rail/TRA"
+AUTH_URL = f"{TDX_HOST}/auth/realms/TDXConnect/protocol/openid-connect/token"
 
 TW_TZ = timezone(timedelta(hours=8))
 
-redis_client = None
-if KV_URL:
+# 時刻表來源："od" = 每組起訖站各打一次 DailyTrainTimetable/OD
+#            "bulk" = 每日一次抓全線時刻表，本地索引求解任意起訖站
+ROUTE_SOURCE = os.environ.get('ROUTE_SOURCE', 'od').lower()
+
+# Log 改在回應送出後才寫入 (write-behind)，設為 0 則在回應前同步寫入
+LOG_WRITE_BEHIND = os.environ.get('LOG_WRITE_BEHIND', '1') == '1'
+
+# 分段耗時直方圖寫入 Redis (回應送出後才寫)，設為 0 則只送 Server-Timing header
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+
+# 車站看板 (board=)：預設列出 3 小時內、最多 30 班離站列車
+BOARD_HOURS = 3
+BOARD_LIMIT = 30
+_board_l1 = LocalCache(max_items=64)
+
+# 回報上傳大小上限 (前端送的是最近 30 筆系統紀錄 + diagnostics，正常只有幾 KB)
+MAX_REPORT_BYTES = 64 * 1024
+
+# 批次查詢 (routes=) 一次最多幾組起訖站
+MAX_BATCH_ROUTES = 8
+
+# 一般查詢的 Cache-Control (60 秒)
+QUERY_CACHE_CONTROL = 'public, max-age=60, s-maxage=60'
+
+# 離線時刻表包 (bundle=)：整天不變，交給瀏覽器 / service worker / CDN 長時間快取；缺了某一天的只快取 5 分鐘
+BUNDLE_CACHE_CONTROL = 'public, max-age=3600, s-maxage=21600, stale-while-revalidate=86400'
+BUNDLE_PARTIAL_CACHE_CONTROL = 'public, max-age=300, s-maxage=300'
+# 即時誤點 (delays=1)：所有人拿到的都一樣，CDN 快取 30 秒就能擋掉大部分呼叫
+DELAY_FEED_CACHE_CONTROL = 'public, max-age=30, s-maxage=30'
+# 時刻表包查詢的回報 (ping=1)：每次都要進到函式裡記錄，不能被快取
+PING_CACHE_CONTROL = 'no-store'
+
+# 預熱下一個營運日的時刻表：預設取前 30 熱門路線，最多打 40 次 TDX
+WARMUP_TOP_N = int(os.environ.get('WARMUP_TOP_N', '30'))
+WARMUP_BUDGET = int(os.environ.get('WARMUP_BUDGET', '40'))
+
+# 全線索引體積大，L1 另開一個小的 (最多保留 3 個營運日)
+_daily_index_l1 = LocalCache(max_items=3)
+
+# 編譯好的路線快照 (只放行程內)：entry 值為 (來源版本, RouteSnapshot)，來源換了才重編。
+# bulk 模式的來源版本是全線索引的 gen，不抓住整份索引；OD 模式直接比對 (很小的) 路線列
+_snapshot_l1 = LocalCache(max_items=256)
+
+# 回應快取 (同一分鐘、同一版誤點的同一組查詢)：body 另開一個 L1，不跟 token / 誤點資料搶 local_cache 的位置
+RESP_CACHE_TTL = 90
+_resp_l1 = LocalCache(max_items=128)
+
+# swr_get 回傳的來源 -> diagnostics 顯示字串 (leader / fallback 顯示上游的 API 狀態)
+SWR_STATUS = {"L1": "Mem Cache", "L2": "Redis", "stale": "Redis(Stale)", "coalesced": "Redis(SF)"}
+
+# 目前的台灣時間 (獨立成函式，方便 bench 模擬深夜等情境)
+def now_tw():
+    return datetime.now(timezone.utc).astimezone(TW_TZ)
+
+# 誤點快取格式 {"v": 版本, "d": {車次: 誤點分鐘}}；舊格式 (沒有版本) 視為 miss
+def decode_delay_data(payload):
+    data = json.loads(payload)
+    return data if isinstance(data, dict) and "v" in data and "d" in data else None
+
+# 回應快取格式 b"班次數|ETag|" + body
+def encode_resp_entry(entry):
+    count, etag, body = entry
+    return f"{count}|{etag}|".encode() + body
+
+def decode_resp_entry(payload):
+    count, etag, body = payload.split(b"|", 2)
+    return (int(count), etag.decode(), body)
+
+def body_etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+def parse_route_pairs(routes_param):
+    """'臺北-板橋,板橋-臺北' -> [('臺北', '板橋'), ('板橋', '臺北')]，去掉空白與重複"""
+    pairs = []
+    for item in routes_param.split(','):
+        start_station, _, end_station = item.partition('-')
+        pair = (start_station.strip(), end_station.strip())
+        if pair[0] and pair[1] and pair not in pairs: pairs.append(pair)
+    return pairs
+
+class LazyRedis:
+    """
+    第一次下指令時才 import redis、建立連線池，之後所有請求 (與所有執行緒) 共用同一個 pool。
+    import 階段不再連線 / PING，冷啟動省掉一趟 Redis 與 redis 套件的載入時間。
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import redis
+                    self._client = redis.from_url(self.url, socket_connect_timeout=3, socket_timeout=5,
+                                                  health_check_interval=30)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._connect(), name)
+
+redis_client = LazyRedis(KV_URL) if KV_URL else None
+if not KV_URL: print("Warning: No Redis URL found.")
+
+# [Log 全域開關] 沒設定過視為開啟；行程內快取 10 秒，省掉每次請求一趟 GET
+def get_logging_enabled():
+    entry = local_cache.get("config:logging_enabled")
+    if entry: return entry[0]
+    config_val = redis_client.get("config:logging_enabled")
+    enabled = (config_val.decode('utf-8') == "1") if config_val else True
+    local_cache.set("config:logging_enabled", enabled, time.time() + 10, time.time() + 10)
+    return enabled
+
+# [Log 批次寫入] 所有指令包成一個 MULTI/EXEC，只走一趟 Redis
+def write_log_entries(final_log, sid, is_globally_enabled):
     try:
-        redis_client = redis.from_url(KV_URL)
-        redis_client.ping()
-        print("Redis Connected Successfully")
+        key = f"session:{sid}"
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.lpush(key, final_log)
+        pipe.ltrim(key, 0, 199) 
+        pipe.expire(key, SESSION_TTL) 
+        pipe.zadd(SESSION_INDEX, {sid: time.time()})
+        
+        # 寫入 System Log
+        if is_globally_enabled:
+            pipe.lpush("sys_logs", final_log)
+            pipe.ltrim("sys_logs", 0, 99)
+        pipe.execute()
     except Exception as e:
-        print(f"Redis Connection Error: {e}")
-        redis_client = None
-else:
-    print("Warning: No Redis URL found.")
+        print(f"Log Error: {e}")
 
-# [Log 寫入函式]
-def log_to_redis_logic(log_entry, sid):
+# [Log 寫入函式] log_entry 為精簡欄位 dict (見 admin_store.encode_log_entry)；
+# defer 傳入 list 時不立即寫入，改由呼叫端在回應送出後執行
+def log_to_redis_logic(log_entry, sid, defer=None):
     if not redis_client or not sid: return False
     
     try:
         # 1. 檢查全域開關
-        config_val = redis_client.get("config:logging_enabled")
-        is_globally_enabled = (config_val.decode('utf-8') == "1") if config_val else True
+        is_globally_enabled = get_logging_enabled()
         
-        final_log = log_entry
         should_continue = True
 
         # 2. 如果全域關閉，但在 Log 尾端加註，並回傳 False
         if not is_globally_enabled:
-            final_log += "\n                 [System] Logging stopped (Config OFF)"
+            log_entry = dict(log_entry, x=1)
             should_continue = False
+        final_log = encode_log_entry(log_entry)
 
         # 3. 執行寫入 (無論開關為何，只要有 sid 都寫入這一次)
-        key = f"session:{sid}"
-        redis_client.lpush(key, final_log)
-        redis_client.ltrim(key, 0, 199) 
-        redis_client.expire(key, 86400) 
-        
-        # 寫入 System Log
-        if is_globally_enabled:
-            redis_client.lpush("sys_logs", final_log)
-            redis_client.ltrim("sys_logs", 0, 99)
+        if defer is not None:
+            defer.append(lambda: write_log_entries(final_log, sid, is_globally_enabled))
+        else:
+            write_log_entries(final_log, sid, is_globally_enabled)
 
         return should_continue
 
@@ -76,28 +223,48 @@ def log_to_redis_logic(log_entry, sid):
 class handler(BaseHTTPRequestHandler):
 
     def get_token(self, cid, csecret):
-        if redis_client:
-            try:
-                cached_token = redis_client.get("tdx_token")
-                if cached_token: return cached_token.decode('utf-8')
-            except: pass
+        entry = local_cache.get("tdx_token")
+        if entry: return entry[0]
+
+        def load(key="tdx_token"):
+            if not redis_client: return None
+            cached_token = redis_client.get(key)
+            return cached_token.decode('utf-8') if cached_token else None
+
+        def remember(token):
+            # Redis 的 token 比實際效期早 10 分鐘過期，L1 只留 5 分鐘一定安全
+            if token: local_cache.set("tdx_token", token, time.time() + 300, time.time() + 300)
+            return token
 
-        auth_url = "https://tdx.transportdata.tw/auth/realms/TDXConnect/protocol/openid-connect/token"
         try:
-            res = requests.post(auth_url, data={'grant_type': 'client_credentials','client_id': cid,'client_secret': csecret})
-            if res.status_code == 200: 
-                data = res.json()
-                token = data.get('access_token')
-                expires = data.get('expires_in', 86400)
-                if redis_client and token:
-                    try: redis_client.set("tdx_token", token, ex=expires - 600)
-                    except: pass
-                return token
-            return None
+            cached_token = load()
+            if cached_token: return remember(cached_token)
+        except: pass
+
+        def refresh():
+            self.timer.incr("token_fetch")
+            res = upstream.post(AUTH_URL, data={'grant_type': 'client_credentials','client_id': cid,'client_secret': csecret})
+            if res.status_code != 200: return None
+            data = res.json()
+            token = data.get('access_token')
+            expires = data.get('expires_in', 86400)
+            if redis_client and token:
+                try:
+                    # 正式 key 提早 10 分鐘過期；stale 副本留到真正過期前 1 分鐘，給等待中的 invocation 用
+                    redis_client.set("tdx_token", token, ex=expires - 600)
+                    redis_client.set("tdx_token:stale", token, ex=expires - 60)
+                except: pass
+            return token
+
+        try:
+            token, _ = single_flight(redis_client, "token", load, refresh, load_stale=lambda: load("tdx_token:stale"))
+            return remember(token)
         except Exception as e:
             return None
 
     def get_header_info(self, res):
+        # 順便記下剩餘額度，給 quota 分級用
+        quota.tracker.observe(redis_client, res)
         val = None
         for k, v in res.headers.items():
             if 'remaining' in k.lower(): val = v; break
@@ -105,113 +272,274 @@ class handler(BaseHTTPRequestHandler):
         return "API"
 
     def get_cached_delays(self, headers, allow_api=True):
-        cache_key = "v3_tra_delay_data"
-        if redis_client:
-            try:
-                cached_data = redis_client.get(cache_key)
-                if cached_data:
-                    return (json.loads(cached_data), "Redis")
-            except: pass
-
-        if not allow_api:
-            return ({}, "Skipped")
-
-        res = requests.get(f"{API_BASE_V2}/LiveTrainDelay", headers=headers)
-        if res.status_code == 200:
-            status_str = self.get_header_info(res)
+        api_status = ["API"]
+        def loader():
+            res = upstream.get(f"{API_BASE_V2}/LiveTrainDelay", headers=headers)
+            api_status[0] = self.get_header_info(res)
+            if res.status_code != 200:
+                raise Exception(f"Delay Error: {res.status_code}")
             d_data = res.json()
             d_list = d_data.get('LiveTrainDelay', []) if isinstance(d_data, dict) else d_data
-            new_delays = {t.get('TrainNo'): t.get('DelayTime', 0) for t in d_list}
+            delays = {t.get('TrainNo'): t.get('DelayTime', 0) for t in d_list}
+            # 版本 = 內容雜湊，內容沒變的話各 instance 算出來的版本都一樣
+            version = format(zlib.crc32(json.dumps(delays, sort_keys=True).encode()), '08x')
+            # 保留 30 分鐘的歷史版本，給 delta 模式比對用
             if redis_client:
-                try: 
-                    redis_client.set(cache_key, json.dumps(new_delays), ex=75)
+                try: redis_client.set(f"v3_tra_delay_hist_{version}", json.dumps(delays), ex=1800)
                 except: pass
-            return (new_delays, status_str)
-        else: 
-            raise Exception(f"Delay Error: {res.status_code}")
+            local_cache.set(f"v3_tra_delay_hist_{version}", delays, time.time() + 1800, time.time() + 1800)
+            return {"v": version, "d": delays}
 
-    def get_route_timetable(self, start_id, end_id, date_str, headers):
-        cache_key = f"v3_route_{start_id}_{end_id}_{date_str}"
-        if redis_client:
-            try:
-                cached_route = redis_client.get(cache_key)
-                if cached_route:
-                    return (json.loads(cached_route), "Redis")
-            except: pass
-
-        res = requests.get(f"{API_BASE_V3}/DailyTrainTimetable/OD/{start_id}/to/{end_id}/{date_str}", headers=headers)
-        if res.status_code == 200:
-            status_str = self.get_header_info(res)
-            raw_list = res.json().get('TrainTimetables', [])
-            if redis_client:
-                try: redis_client.set(cache_key, json.dumps(raw_list), ex=43200)
-                except: pass
-            return (raw_list, status_str)
-        else: 
-            raise Exception(f"Timetable Error: {res.status_code}")
-
-    def process_daily_list(self, raw_list, date_str, start_id, end_id, delays, now_aware, fix_crossing_night=False):
-        processed = []
-        for item in raw_list:
-            info = item.get('TrainInfo', {})
-            no = info.get('TrainNo')
-            raw_type = info.get('TrainTypeName', {}).get('Zh_tw', '')
-            stop_times = item.get('StopTimes', [])
-            dep_time, arr_time = None, None
-            for stop in stop_times:
-                s_id = stop.get('StationID')
-                if s_id == start_id: dep_time = stop.get('DepartureTime')
-                elif s_id == end_id: arr_time = stop.get('ArrivalTime')
-            if not dep_time or not arr_time: continue 
-
-            display_type = raw_type
-            type_color = "#ffffff"
-            if "區間快" in raw_type: display_type, type_color = "區間快", "#0076B2"
-            elif "區間" in raw_type: display_type, type_color = "區間車", "#0076B2"
-            elif "普悠瑪" in raw_type: display_type, type_color = "普悠瑪", "#9C1637"
-            elif "3000" in raw_type: display_type, type_color = "自強3000", "#ffffff"
-            elif "自強" in raw_type: display_type, type_color = "自強號", "#DF3F1F"
-            elif "太魯閣" in raw_type: display_type, type_color = "太魯閣", "#9C1637"
-            elif "莒光" in raw_type: display_type, type_color = "莒光號", "#FF8C00"
-
-            raw_delay = int(delays.get(no, 0))
-            dep_dt = datetime.strptime(f"{date_str} {dep_time}", "%Y-%m-%d %H:%M").replace(tzinfo=TW_TZ)
-            arr_dt = datetime.strptime(f"{date_str} {arr_time}", "%Y-%m-%d %H:%M").replace(tzinfo=TW_TZ)
-
-            if fix_crossing_night:
-                if dep_time < "12:00": dep_dt += timedelta(days=1)
-                if arr_time < "12:00": arr_dt += timedelta(days=1)
-
-            if arr_dt < dep_dt: arr_dt += timedelta(days=1)
-            time_diff_seconds = (dep_dt - now_aware).total_seconds()
-            
-            if time_diff_seconds > 21600: delay = 0
-            else: delay = raw_delay
-
-            real_dep = dep_dt + timedelta(minutes=delay)
-            real_arr = arr_dt + timedelta(minutes=delay)
-            is_past = real_dep < (now_aware - timedelta(minutes=10))
-
-            processed.append({
-                "no": no, "type": display_type, "delay": delay, "color": type_color,
-                "act_dep": real_dep.strftime("%H:%M"), "act_arr": real_arr.strftime("%H:%M"),
-                "dep_date": real_dep.strftime("%Y-%m-%d"), "arr_date": real_arr.strftime("%Y-%m-%d"),
-                "sch_dep": dep_time, "sch_arr": arr_time, "sort_key": real_dep.timestamp(), "is_past": is_past
-            })
-        return processed
+        # 75 秒內視為新鮮；10 分鐘內先回舊值再背景更新 (額度吃緊時依倍率拉長，再不行只回舊值)
+        level = self.quota_state["level"]
+        allow_api = allow_api and quota.allows(level, quota.PRIORITY_NORMAL)
+        factor = quota.ttl_factor(level)
+        data, source = swr_get(redis_client, "v3_tra_delay_data", loader if allow_api else None,
+                               soft_ttl=75 * factor, hard_ttl=600 * factor, stale_ttl=1800,
+                               stats=self.cache_stats, pending=self.refreshes, decode=decode_delay_data, kind="delay")
+        if data is None: return ({}, "Skipped", "none")
+        return (data["d"], SWR_STATUS.get(source, api_status[0]), data["v"])
+
+    def get_delay_history(self, version):
+        """取回某一版的誤點資料，過期或不存在回傳 None"""
+        key = f"v3_tra_delay_hist_{version}"
+        entry = local_cache.get(key)
+        if entry: return entry[0]
+        if not redis_client: return None
+        try:
+            cached = redis_client.get(key)
+            return json.loads(cached) if cached else None
+        except: return None
+
+    def get_daily_index(self, date_str, headers, priority=quota.PRIORITY_CRITICAL):
+        api_status = ["API"]
+        def loader():
+            res = upstream.get(f"{API_BASE_V3}/DailyTrainTimetable/TrainDate/{date_str}", headers=headers)
+            api_status[0] = self.get_header_info(res)
+            if res.status_code != 200:
+                raise Exception(f"Timetable Error: {res.status_code}")
+            return build_daily_index(res.json().get('TrainTimetables', []))
+
+        level = self.quota_state["level"]
+        factor = quota.ttl_factor(level)
+        index, source = swr_get(redis_client, f"v3_daily_{date_str}", loader if quota.allows(level, priority) else None,
+                                soft_ttl=21600 * factor, hard_ttl=43200 * factor, stale_ttl=86400,
+                                stats=self.cache_stats, pending=self.refreshes, l1=_daily_index_l1,
+                                encode=encode_daily_index, decode=decode_daily_index, kind="daily")
+        return (index, SWR_STATUS.get(source, api_status[0]))
+
+    def get_route_timetable(self, start_id, end_id, date_str, headers, priority=quota.PRIORITY_CRITICAL):
+        if ROUTE_SOURCE == 'bulk':
+            index, status_str = self.get_daily_index(date_str, headers, priority)
+            return (query_od(index, start_id, end_id) if index else None, status_str)
+
+        api_status = ["API"]
+        def loader():
+            res = upstream.get(f"{API_BASE_V3}/DailyTrainTimetable/OD/{start_id}/to/{end_id}/{date_str}", headers=headers)
+            api_status[0] = self.get_header_info(res)
+            if res.status_code != 200:
+                raise Exception(f"Timetable Error: {res.status_code}")
+            return normalize_od(res.json().get('TrainTimetables', []), start_id, end_id)
+
+        # Redis 只存起訖兩站的精簡二進位列，不再存整包 TrainTimetables
+        level = self.quota_state["level"]
+        factor = quota.ttl_factor(level)
+        rows, source = swr_get(redis_client, f"v3_route_{start_id}_{end_id}_{date_str}",
+                               loader if quota.allows(level, priority) else None,
+                               soft_ttl=21600 * factor, hard_ttl=43200 * factor, stale_ttl=86400,
+                               stats=self.cache_stats, pending=self.refreshes,
+                               encode=encode_route_rows, decode=decode_route_rows, kind="route")
+        return (rows, SWR_STATUS.get(source, api_status[0]))
+
+    def get_route_snapshot(self, start_id, end_id, date_str, headers, fix_crossing_night=False,
+                           priority=quota.PRIORITY_CRITICAL):
+        if ROUTE_SOURCE == 'bulk':
+            source, status_str = self.get_daily_index(date_str, headers, priority)
+            build = lambda: query_od(source, start_id, end_id)
+        else:
+            source, status_str = self.get_route_timetable(start_id, end_id, date_str, headers, priority)
+            build = lambda: source
+
+        # 額度不足被擋下、快取裡也沒有：今日時刻表只能報錯，其餘的當作沒有這一天
+        if source is None:
+            if priority == quota.PRIORITY_CRITICAL: raise Exception("Timetable Error: quota exhausted")
+            return (None, "Quota Skip")
+
+        version = source["gen"] if ROUTE_SOURCE == 'bulk' else source
+        snap_key = f"{start_id}_{end_id}_{date_str}_{int(fix_crossing_night)}"
+        entry = _snapshot_l1.get(snap_key)
+        if entry and entry[0][0] == version:
+            return (entry[0][1], status_str)
+
+        snap = compile_route(build(), date_str, fix_crossing_night)
+        _snapshot_l1.set(snap_key, (version, snap), time.time() + 43200, time.time() + 43200)
+        return (snap, status_str)
+
+    def get_board_snapshot(self, station_id, date_str, headers, fix_crossing_night=False,
+                           priority=quota.PRIORITY_CRITICAL):
+        """某站某日所有離站班次 (由全線索引求得)，回傳 ((RouteSnapshot, {車次: 終點站ID}), status)"""
+        index, status_str = self.get_daily_index(date_str, headers, priority)
+        if index is None:
+            if priority == quota.PRIORITY_CRITICAL: raise Exception("Timetable Error: quota exhausted")
+            return (None, "Quota Skip")
+
+        board_key = f"{station_id}_{date_str}_{int(fix_crossing_night)}"
+        entry = _board_l1.get(board_key)
+        if entry and entry[0][0] == index["gen"]:
+            return (entry[0][1], status_str)
+
+        rows = query_departures(index, station_id)
+        board = (compile_route([r[:4] for r in rows], date_str, fix_crossing_night), {r[0]: r[4] for r in rows})
+        # 只記索引的 gen：抓著整份索引的話，被換掉的舊索引會被最多 64 筆看板留住 12 小時
+        _board_l1.set(board_key, (index["gen"], board), time.time() + 43200, time.time() + 43200)
+        return (board, status_str)
+
+    def run_cached(self, fn, *args, **kwargs):
+        """
+        先在請求執行緒內以 cache_only 執行 fn：L1 / Redis 命中 (含 stale) 直接做完，包成已完成的 Future；
+        需要同步打 TDX 才把 fn 丟進 upstream pool。快取命中的請求不必跟別人的上游呼叫排隊。
+        """
+        f = Future()
+        try:
+            with cache_only(): f.set_result(fn(*args, **kwargs))
+        except NeedsUpstream:
+            return upstream.submit(fn, *args, **kwargs)
+        except Exception as e:
+            f.set_exception(e)
+        return f
+
+    def quota_diagnostics(self):
+        level = self.quota_state["level"]
+        return {"remaining": self.quota_state["remaining"], "level": level, "ttl_factor": quota.ttl_factor(level),
+                "deferred": [name for name, p in (("prefetch", quota.PRIORITY_PREFETCH), ("delay", quota.PRIORITY_NORMAL),
+                                                  ("today", quota.PRIORITY_CRITICAL)) if not quota.allows(level, p)]}
+
+    def process_daily_list(self, snap, delays, now_aware, lo=0, hi=None):
+        return overlay_delays(snap, delays, now_aware.timestamp(), lo, hi)
+
+    def collect_trains(self, snaps, delays, now_aware, want_next_day, bounds=None, window=None):
+        """
+        疊加誤點、套用時間窗、依 sort_key 合併並去重；回傳 (班次清單, (past_limit, future_limit))
+        bounds = delay_bounds(delays)，同一份誤點要算多條路線時 (批次查詢) 由呼叫端先算好傳進來
+        window = (past_limit, future_limit)，預設為今天 00:00 ~ 現在 +24 (want_next_day 為 48) 小時
+        """
+        if window:
+            past_limit, future_limit = window
+        else:
+            now_ts = now_aware.timestamp()
+            past_limit = now_aware.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+            future_limit = now_ts + (48 if want_next_day else 24) * 3600
+
+        min_delay, max_delay = bounds or delay_bounds(delays)
+        processed, spans = [], []
+        for snap in snaps:
+            span = delay_span(snap, min_delay, max_delay) if snap else None
+            if not span: continue
+            if past_limit <= span[0] and span[1] <= future_limit:
+                # 整份都在時間窗內 (查詢的今日 / 明日清單)：直接疊加，不必切也不必過濾
+                processed.extend(self.process_daily_list(snap, delays, now_aware))
+            else:
+                # 只有部分在窗內 (昨日跨夜清單、看板)：快照依表定發車排序，bisect 切出候選範圍再過濾
+                lo, hi = window_range(snap, past_limit, future_limit, min_delay, max_delay)
+                processed.extend(p for p in self.process_daily_list(snap, delays, now_aware, lo, hi)
+                                 if past_limit <= p['sort_key'] <= future_limit)
+            spans.append(span)
+
+        # 昨日跨夜清單與今日的凌晨班次會重複：時間範圍有重疊才需要去重 (同一 sort_key 的同一車次，後面的清單優先)
+        if any(prev[1] >= nxt[0] for prev, nxt in zip(spans, spans[1:])):
+            processed = list({(p['sort_key'], p['no']): p for p in processed}.values())
+        processed.sort(key=itemgetter('sort_key'))
+        return (processed, (past_limit, future_limit))
+
+    def route_status_text(self, statuses, now_aware, want_next_day):
+        status_today, status_tmrw, status_yest = statuses["today"], statuses["tmrw"], statuses["yest"]
+        if now_aware.hour < 4: return f"Y:{status_yest} / T:{status_today} / N:{status_tmrw}"
+        elif want_next_day: return f"T:{status_today} / N:{status_tmrw} (Loaded)"
+        else: return f"T:{status_today} / N:Skipped"
+
+    def render_route_body(self, start_station, end_station, want_next_day, now_aware, snaps,
+                          delays, delay_failed, delay_version, statuses, delay_status, logging_enabled_resp):
+        """回傳 (班次數, ETag, JSON body bytes)"""
+        result, _ = self.collect_trains(snaps, delays, now_aware, want_next_day)
+
+        body = json.dumps({
+            "update_time": now_aware.strftime("%H:%M:%S"),
+            "start": start_station, "end": end_station, "delay_failed": delay_failed,
+            "delay_version": delay_version,
+            "trains": result, "stats": { "original_count": len(result) },
+            "diagnostics": { "route_status": self.route_status_text(statuses, now_aware, want_next_day),
+                             "delay_status": delay_status, "cache": self.cache_stats.as_dict(),
+                             "quota": self.quota_diagnostics() },
+            "logging_enabled": logging_enabled_resp 
+        }).encode()
+        return (len(result), body_etag(body), body)
+
+    def render_delta_body(self, start_station, end_station, want_next_day, now_aware, snaps, delays, delay_version,
+                          base_version, base_delays, have_until, statuses, delay_status, logging_enabled_resp):
+        """
+        只回傳相對於 base_version 有變動的班次：誤點改變、或是新進入時間窗 (sort_key > have_until)。
+        以 (車次, 表定發車 timestamp) 對應新舊兩份清單。回傳 (變動班次數, JSON body bytes)
+        """
+        result, (past_limit, future_limit) = self.collect_trains(snaps, delays, now_aware, want_next_day)
+        if base_version == delay_version:
+            old_delay = None
+        else:
+            base_result, _ = self.collect_trains(snaps, base_delays, now_aware, want_next_day)
+            old_delay = {(p['no'], p['sort_key'] - p['delay'] * 60): p['delay'] for p in base_result}
+
+        changed = []
+        for p in result:
+            if have_until is not None and p['sort_key'] > have_until:
+                changed.append(p)
+            elif old_delay is not None and old_delay.get((p['no'], p['sort_key'] - p['delay'] * 60)) != p['delay']:
+                changed.append(p)
+
+        body = json.dumps({
+            "delta": True, "base_version": base_version, "delay_version": delay_version,
+            "update_time": now_aware.strftime("%H:%M:%S"),
+            "start": start_station, "end": end_station, "delay_failed": False,
+            "window": [past_limit, future_limit], "changed": changed,
+            "stats": { "original_count": len(result) },
+            "diagnostics": { "route_status": self.route_status_text(statuses, now_aware, want_next_day),
+                             "delay_status": delay_status, "cache": self.cache_stats.as_dict(),
+                             "quota": self.quota_diagnostics() },
+            "logging_enabled": logging_enabled_resp
+        }).encode()
+        return (len(changed), body)
+
+    def read_body(self, limit):
+        """依 Content-Length 分段讀取，超過 limit 直接拒絕、不讀進記憶體；回傳 bytes 或 None (已回應錯誤)"""
+        try: content_length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error_response("Length Required", 411)
+            return None
+        if content_length < 0 or content_length > limit:
+            self.send_error_response(f"Payload Too Large (max {limit} bytes)", 413)
+            return None
+        chunks, remaining = [], content_length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 16384))
+            if not chunk: break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
 
     def do_POST(self):
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            post_data = self.read_body(MAX_REPORT_BYTES)
+            if post_data is None: return
             data = json.loads(post_data.decode('utf-8'))
+            if not isinstance(data, dict): return self.send_error_response("Upload Failed: report must be an object", 400)
             
             now_str = datetime.now(timezone(timedelta(hours=8))).strftime("%Y%m%d_%H%M%S")
             rand_id = random.randint(1000, 9999)
             report_id = f"report:{now_str}_{rand_id}"
             
             if redis_client:
-                redis_client.set(report_id, json.dumps(data), ex=604800)
+                pipe = redis_client.pipeline(transaction=True)
+                pipe.set(report_id, encode_report(data), ex=REPORT_TTL)
+                pipe.zadd(REPORT_INDEX, {report_id.replace("report:", "", 1): time.time()})
+                pipe.execute()
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
@@ -239,10 +567,26 @@ class handler(BaseHTTPRequestHandler):
                 return
 
             action = params.get('action', ['list_sessions'])[0]
+            try: page_limit = min(max(int(params.get('limit', ['200'])[0]), 1), 1000)
+            except ValueError: page_limit = 200
             result = {}
             if redis_client:
                 try:
-                    if action == 'get_config':
+                    if action == 'warmup':
+                        self.init_request_state()
+                        try: top_n = int(params.get('top', [WARMUP_TOP_N])[0])
+                        except ValueError: top_n = WARMUP_TOP_N
+                        try: budget = int(params.get('budget', [WARMUP_BUDGET])[0])
+                        except ValueError: budget = WARMUP_BUDGET
+                        result.update(self.warm_routes(top_n, budget, params.get('date', [None])[0]))
+                    elif action == 'metrics':
+                        result["windows"] = summarize_metrics(redis_client)
+                        result["singleflight"] = single_flight_stats(redis_client)
+                        result["quota"] = quota.tracker.state(redis_client)
+                    elif action == 'singleflight_stats':
+                        result["singleflight"] = single_flight_stats(redis_client,
+                                                                     reset=params.get('reset', ['0'])[0] == '1')
+                    elif action == 'get_config':
                         val = redis_client.get("config:logging_enabled")
                         result["logging_enabled"] = val.decode('utf-8') if val else "1"
                     elif action == 'set_config':
@@ -250,50 +594,51 @@ class handler(BaseHTTPRequestHandler):
                         val = params.get('val', [''])[0]
                         if key == "logging_enabled":
                             redis_client.set("config:logging_enabled", val)
+                            local_cache.delete("config:logging_enabled")
                             result["status"] = "ok"
                             result["set_to"] = val
                     elif action == 'clear_sessions':
-                        keys = redis_client.keys("session:*")
-                        if keys: redis_client.delete(*keys)
+                        result["deleted"] = clear_prefix(redis_client, "session:", SESSION_INDEX)
                         result["status"] = "ok"
                     elif action == 'clear_reports':
-                        keys = redis_client.keys("report:*")
-                        if keys: redis_client.delete(*keys)
+                        result["deleted"] = clear_prefix(redis_client, "report:", REPORT_INDEX)
+                        result["status"] = "ok"
+                    elif action == 'rebuild_index':
+                        result["sessions_added"] = rebuild_index(redis_client, "session:", SESSION_INDEX, SESSION_TTL)
+                        result["reports_added"] = rebuild_index(redis_client, "report:", REPORT_INDEX, REPORT_TTL)
                         result["status"] = "ok"
                     elif action == 'list_sessions':
-                        keys = redis_client.keys("session:*")
+                        items, next_cursor = list_indexed(redis_client, SESSION_INDEX, "session:", SESSION_TTL,
+                                                          cursor=params.get('cursor', [None])[0], limit=page_limit)
                         session_list = []
-                        now_ts = datetime.now(timezone(timedelta(hours=8)))
-                        for k in keys:
-                            k_str = k.decode('utf-8')
-                            ttl = redis_client.ttl(k_str)
-                            elapsed = 86400 - (ttl if ttl > 0 else 86400)
-                            last_active = now_ts - timedelta(seconds=elapsed)
+                        for sid_str, score, ttl in items:
+                            last_active = datetime.fromtimestamp(score, TW_TZ)
                             session_list.append({
-                                "id": k_str.replace("session:", ""),
+                                "id": sid_str,
                                 "ttl": ttl,
                                 "last_active_str": last_active.strftime("%m/%d %H:%M:%S")
                             })
-                        session_list.sort(key=lambda x: x['ttl'], reverse=True)
                         result["sessions"] = session_list
+                        result["next_cursor"] = next_cursor
                     elif action == 'get_session_logs':
                         target_sid = params.get('sid', [''])[0]
                         if target_sid:
                             logs = redis_client.lrange(f"session:{target_sid}", 0, -1)
-                            logs = [l.decode('utf-8') for l in logs]
+                            logs = render_log_entries(logs)
                             logs.reverse()
                             result["logs"] = logs
                         else:
                             result["logs"] = ["Please provide sid"]
                     elif action == 'list_reports':
-                        keys = redis_client.keys("report:*")
-                        keys = sorted([k.decode('utf-8') for k in keys], reverse=True)
-                        result["reports"] = keys
+                        items, next_cursor = list_indexed(redis_client, REPORT_INDEX, "report:", REPORT_TTL,
+                                                          cursor=params.get('cursor', [None])[0], limit=page_limit)
+                        result["reports"] = [f"report:{rid}" for rid, _, _ in items]
+                        result["next_cursor"] = next_cursor
                     elif action == 'get_report':
                         target_id = params.get('id', [''])[0]
                         if target_id:
                             content = redis_client.get(target_id)
-                            result["report_content"] = json.loads(content) if content else "Not Found"
+                            result["report_content"] = decode_report(content) if content else "Not Found"
 
                 except Exception as e:
                     result["error"] = str(e)
@@ -316,113 +661,547 @@ class handler(BaseHTTPRequestHandler):
         end_station = params.get('end', [''])[0]
         want_next_day = params.get('next_day', ['0'])[0] == '1'
         sid = params.get('sid', [None])[0]
+        # [Delta 模式] 帶上已持有的誤點版本，只回傳有變動的班次
+        since_version = params.get('since', [''])[0]
+        try: have_until = float(params.get('until', [''])[0])
+        except ValueError: have_until = None
         
         raw_mode = params.get('mode', ['Query'])[0]
-        req_mode_log = raw_mode.capitalize() 
 
-        if not CLIENT_ID or not CLIENT_SECRET: return self.send_error_response("Missing Env")
+        self.init_request_state()
+
+        def dispatch():
+            if not CLIENT_ID or not CLIENT_SECRET: raise Exception("Missing Env")
+            routes_param = params.get('routes', [''])[0]
+            if routes_param:
+                return self.do_batch(routes_param, want_next_day, sid)
+            board_station = params.get('board', [''])[0]
+            if board_station:
+                try: hours = float(params.get('hours', [BOARD_HOURS])[0])
+                except ValueError: hours = BOARD_HOURS
+                # nan / inf 會穿過 min/max 夾值，直接用預設值
+                hours = min(max(hours, 0.5), 12) if math.isfinite(hours) else BOARD_HOURS
+                try: limit = min(max(int(params.get('limit', [BOARD_LIMIT])[0]), 1), 100)
+                except ValueError: limit = BOARD_LIMIT
+                return self.do_board(board_station, hours, limit, sid)
+            bundle_param = params.get('bundle', [''])[0]
+            if bundle_param:
+                return self.do_bundle(bundle_param, params.get('date', [''])[0])
+            if params.get('delays', ['0'])[0] == '1':
+                return self.do_delay_feed()
+            if params.get('ping', ['0'])[0] == '1':
+                try: count = min(max(int(params.get('count', ['0'])[0]), 0), 10000)
+                except ValueError: count = 0
+                return self.do_ping(start_station, end_station, want_next_day, sid, raw_mode, count)
+            return self.do_route(start_station, end_station, want_next_day, sid, raw_mode, since_version, have_until)
+
+        self.serve_query(dispatch)
+
+    def do_route(self, start_station, end_station, want_next_day, sid, raw_mode, since_version, have_until):
+        """單一起訖站查詢 (含 delta 模式與回應快取)"""
+        req_mode_log = raw_mode.capitalize() 
         start_id = STATION_MAP.get(start_station)
         end_id = STATION_MAP.get(end_station)
-        if not start_id or not end_id: 
-            return self.send_error_response(f"Station Error")
+        if not start_id or not end_id: raise Exception("Station Error")
 
-        token = self.get_token(CLIENT_ID, CLIENT_SECRET)
-        if not token: return self.send_error_response("Auth Failed")
-
-        now_aware = datetime.now(timezone.utc).astimezone(TW_TZ)
+        headers = self.auth_headers()
+        now_aware = now_tw()
         today_str = now_aware.strftime('%Y-%m-%d')
         tomorrow_str = (now_aware + timedelta(days=1)).strftime('%Y-%m-%d')
-        headers = {'authorization': f'Bearer {token}'}
+        self.after_response.append(lambda: record_routes(redis_client, [(start_id, end_id)], now_aware))
 
-        try:
-            raw_today, status_today = self.get_route_timetable(start_id, end_id, today_str, headers)
-            
-            raw_tmrw, status_tmrw = [], "Skipped"
-            if want_next_day:
-                raw_tmrw, status_tmrw = self.get_route_timetable(start_id, end_id, tomorrow_str, headers)
-
-            raw_yest, status_yest = [], "Skipped"
-            if now_aware.hour < 4:
-                yesterday_str = (now_aware - timedelta(days=1)).strftime('%Y-%m-%d')
-                raw_yest, status_yest = self.get_route_timetable(start_id, end_id, yesterday_str, headers)
-
-            delays = {}
-            delay_failed = False
-            delay_status = "Unknown"
-            try: 
-                allow_v2 = (raw_mode != "load_next_day")
-                delays, delay_status = self.get_cached_delays(headers, allow_api=allow_v2)
-            except Exception as e: 
-                delay_failed, delay_status = True, "Failed"
-
-            processed = []
-            if raw_yest:
-                yesterday_str = (now_aware - timedelta(days=1)).strftime('%Y-%m-%d')
-                processed.extend(self.process_daily_list(raw_yest, yesterday_str, start_id, end_id, delays, now_aware, fix_crossing_night=True))
-            processed.extend(self.process_daily_list(raw_today, today_str, start_id, end_id, delays, now_aware))
-            if raw_tmrw:
-                processed.extend(self.process_daily_list(raw_tmrw, tomorrow_str, start_id, end_id, delays, now_aware))
-
-            unique_dict = {f"{p['sort_key']}_{p['no']}": p for p in processed}
-            final_result = []
-            now_ts = now_aware.timestamp()
-            today_start = now_aware.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
-            future_hours = 48 if want_next_day else 24
-            future_limit = now_ts + (future_hours * 3600) 
-            past_limit = today_start 
+        # 昨日 / 今日 / 明日時刻表與誤點資料互不相依，平行抓取
+        allow_v2 = (raw_mode != "load_next_day")
+        get_snapshot = self.timer.timed("timetable", self.get_route_snapshot)
+        f_delay = self.submit_delays(headers, allow_api=allow_v2)
+        f_today = self.run_cached(get_snapshot, start_id, end_id, today_str, headers)
+        f_tmrw = (self.run_cached(get_snapshot, start_id, end_id, tomorrow_str, headers,
+                                  priority=quota.PRIORITY_PREFETCH) if want_next_day else None)
+        f_yest = None
+        if now_aware.hour < 4:
+            yesterday_str = (now_aware - timedelta(days=1)).strftime('%Y-%m-%d')
+            f_yest = self.run_cached(get_snapshot, start_id, end_id, yesterday_str, headers, fix_crossing_night=True,
+                                     priority=quota.PRIORITY_NORMAL)
 
-            for p in unique_dict.values():
-                ts = p['sort_key']
-                if ts >= past_limit and ts <= future_limit:
-                    final_result.append(p)
+        delays, delay_failed, delay_status, delay_version = self.delay_result(f_delay)
+        logging_enabled_resp = self.logging_flag(sid)
 
-            result = sorted(final_result, key=lambda x: x['sort_key'])
-            
-            # [LOGGING LOGIC]
-            logging_enabled_resp = False 
-            if sid:
-                now_log_str = now_aware.strftime("%m/%d %H:%M:%S")
-                
-                v3_log = f"V3 API(剩:{status_today.split(':')[1]})" if "API" in status_today else f"V3 {status_today}"
-                
-                if now_aware.hour < 4: 
-                    v3_log = f"V3 Yest:{status_yest} / Today:{status_today}"
-                elif want_next_day: 
-                    v3_log = f"V3 Today:{status_today} / Tmrw:{status_tmrw}"
-                
-                v2_log = f"V2 {delay_status}"
-                
-                log_text = f"[{now_log_str}] Action: {req_mode_log}\n"
-                log_text += f"                 {start_station} -> {end_station}\n"
-                log_text += f"                 {v3_log} / {v2_log}\n"
-                log_text += f"                 Result: {len(result)} trains"
-                
-                logging_enabled_resp = log_to_redis_logic(log_text, sid)
+        statuses = {}
+        def get_snaps():
+            snap_today, statuses["today"] = f_today.result()
+            snap_tmrw, statuses["tmrw"] = f_tmrw.result() if f_tmrw else (None, "Skipped")
+            snap_yest, statuses["yest"] = f_yest.result() if f_yest else (None, "Skipped")
+            return (snap_yest, snap_today, snap_tmrw)
 
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            # 一般查詢保持 60 秒快取
-            self.send_header('Cache-Control', 'public, max-age=60, s-maxage=60')
-            self.end_headers()
+        def render():
+            snaps = get_snaps()
+            with self.timer.stage("process"):
+                return self.render_route_body(start_station, end_station, want_next_day, now_aware, snaps,
+                                              delays, delay_failed, delay_version, statuses, delay_status,
+                                              logging_enabled_resp)
+
+        base_delays = None
+        if since_version and not delay_failed and delay_version != "none":
+            base_delays = delays if since_version == delay_version else self.get_delay_history(since_version)
+
+        etag, hit = None, False
+        if base_delays is not None:
+            # 基準版本還在才能算 delta，否則照常回傳完整資料
+            snaps = get_snaps()
+            with self.timer.stage("process"):
+                count, body = self.render_delta_body(start_station, end_station, want_next_day, now_aware, snaps,
+                                                     delays, delay_version, since_version, base_delays,
+                                                     have_until, statuses, delay_status, logging_enabled_resp)
+            req_mode_log += "(Delta)"
+        # [回應快取] 同一分鐘、同一版誤點資料的同一組查詢，結果對所有人都一樣
+        elif delay_failed:
+            (count, etag, body), hit = render(), False
+        else:
+            resp_key = (f"v3_resp_{start_id}_{end_id}_{int(want_next_day)}_{int(logging_enabled_resp)}"
+                        f"_{delay_version}_{now_aware.strftime('%Y%m%d%H%M')}")
+            (count, etag, body), hit = self.get_cached_response(resp_key, render)
+        self.count_request(statuses, delay_status, hit)
+        if hit:
+            statuses = {"today": "Resp Cache", "tmrw": "Resp Cache", "yest": "Resp Cache"}
+        
+        # [LOGGING LOGIC]
+        if sid:
+            status_today, status_tmrw, status_yest = statuses["today"], statuses["tmrw"], statuses["yest"]
+            v3_log = status_today
+            if now_aware.hour < 4: 
+                v3_log = f"Yest:{status_yest} / Today:{status_today}"
+            elif want_next_day: 
+                v3_log = f"Today:{status_today} / Tmrw:{status_tmrw}"
 
-            diag_route_status = f"{status_today} / {status_tmrw}"
-            if now_aware.hour < 4: diag_route_status = f"Y:{status_yest} / T:{status_today} / N:{status_tmrw}"
-            elif want_next_day: diag_route_status = f"T:{status_today} / N:{status_tmrw} (Loaded)"
-            else: diag_route_status = f"T:{status_today} / N:Skipped"
-
-            self.wfile.write(json.dumps({
-                "update_time": now_aware.strftime("%H:%M:%S"),
-                "start": start_station, "end": end_station, "delay_failed": delay_failed,
-                "trains": result, "stats": { "original_count": len(final_result) },
-                "diagnostics": { "route_status": diag_route_status, "delay_status": delay_status },
-                "logging_enabled": logging_enabled_resp 
-            }).encode())
+            log_entry = {"t": int(now_aware.timestamp()), "a": req_mode_log,
+                         "r": [[start_station, end_station, count]], "v3": v3_log, "v2": delay_status}
+            with self.timer.stage("log"):
+                log_to_redis_logic(log_entry, sid, defer=self.after_response if LOG_WRITE_BEHIND else None)
+
+        return (body, etag, hit, QUERY_CACHE_CONTROL)
+
+    def get_cached_response(self, key, render):
+        """
+        回應快取：L1 -> Redis -> 自己 render。render 只要 1ms 左右，miss 時不搶租約、不等別人，
+        Redis 寫入也延到回應送出後。回傳 ((班次數, ETag, body), 是否命中)
+        """
+        entry = _resp_l1.get(key)
+        if entry: return (entry[0], True)
+        if redis_client:
+            try:
+                cached = redis_client.get(key)
+                value = decode_resp_entry(cached) if cached else None
+            except Exception: value = None
+            if value:
+                _resp_l1.set(key, value, time.time() + RESP_CACHE_TTL, time.time() + RESP_CACHE_TTL)
+                return (value, True)
+
+        value = render()
+        _resp_l1.set(key, value, time.time() + RESP_CACHE_TTL, time.time() + RESP_CACHE_TTL)
+        if redis_client:
+            self.after_response.append(lambda: redis_client.set(key, encode_resp_entry(value), ex=RESP_CACHE_TTL))
+        return (value, False)
+
+    def serve_query(self, build):
+        """
+        查詢類請求共用的外框：build() 回傳 (body, ETag, 是否命中回應快取, Cache-Control)。
+        任何例外 (參數錯誤、Auth Failed、上游失敗) 都回 500 並記進 metrics；不論成敗最後都跑 finish_request。
+        """
+        try:
+            body, etag, hit, cache_control = build()
+            self.send_query_response(body, etag, hit, cache_control)
         except Exception as e:
+            self.timer.incr("error")
+            self.timer.finish()
             self.send_error_response(str(e))
+        self.finish_request()
+
+    def auth_headers(self):
+        with self.timer.stage("token"):
+            token = self.get_token(CLIENT_ID, CLIENT_SECRET)
+        if not token: raise Exception("Auth Failed")
+        return {'authorization': f'Bearer {token}'}
+
+    def submit_delays(self, headers, allow_api=True):
+        return self.run_cached(self.timer.timed("delay", self.get_cached_delays), headers, allow_api=allow_api)
+
+    def delay_result(self, f_delay):
+        """回傳 (delays, delay_failed, delay_status, delay_version)；誤點抓不到時照樣回傳時刻表"""
+        try:
+            delays, delay_status, delay_version = f_delay.result()
+            return (delays, False, delay_status, delay_version)
+        except Exception:
+            return ({}, True, "Failed", "none")
+
+    def logging_flag(self, sid):
+        if not sid or not redis_client: return False
+        try: return get_logging_enabled()
+        except: return False
+
+    def send_query_response(self, body, etag, hit, cache_control=QUERY_CACHE_CONTROL):
+        inm = self.headers.get('If-None-Match')
+        not_modified = bool(etag and inm) and (inm.strip() == '*' or etag in [t.strip().removeprefix('W/') for t in inm.split(',')])
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # 一般查詢保持 60 秒快取 (時刻表包 / 誤點 feed 另外指定)
+        self.send_header('Cache-Control', cache_control)
+        if etag: self.send_header('ETag', etag)
+        self.send_header('X-Response-Cache', 'HIT' if hit else 'MISS')
+        if not not_modified: self.send_header('Content-Length', str(len(body)))
+        self.timer.finish()
+        self.send_header('Server-Timing', self.timer.server_timing())
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(body)
+        self.wfile.flush()
+
+    def finish_request(self):
+        # 回應已送出：先補寫延後的 Log、記錄耗時，再把 stale-while-revalidate 觸發的背景更新做完
+        with self.timer.stage("after_response"):
+            self.run_after_response()
+        if METRICS_ENABLED:
+            try: self.timer.flush(redis_client)
+            except Exception as e: print(f"Metrics Error: {e}")
+        drain_refreshes(self.refreshes)
+
+    def count_request(self, statuses, delay_status, resp_hit):
+        """上游呼叫次數與各層快取命中數，跟著耗時一起寫進 metrics"""
+        timer = self.timer
+        timer.incr("resp_cache_hit" if resp_hit else "resp_cache_miss")
+        upstream_calls = sum(1 for s in (*statuses.values(), delay_status) if s.startswith("API"))
+        if upstream_calls: timer.incr("upstream_calls", upstream_calls)
+        for field, n in self.cache_stats.as_dict().items():
+            if n: timer.incr(field, n)
+
+    def do_batch(self, routes_param, want_next_day, sid):
+        """
+        多組起訖站一次查詢：routes=臺北-板橋,板橋-臺北
+        共用同一次 token / 誤點資料，所有時刻表平行抓取，結果依輸入順序放在 "routes"。
+        """
+        pairs = parse_route_pairs(routes_param)
+        if not pairs: raise Exception("Station Error")
+        if len(pairs) > MAX_BATCH_ROUTES: raise Exception(f"Too Many Routes (max {MAX_BATCH_ROUTES})")
+
+        headers = self.auth_headers()
+        now_aware = now_tw()
+        known = [(STATION_MAP[a], STATION_MAP[b]) for a, b in pairs if a in STATION_MAP and b in STATION_MAP]
+        self.after_response.append(lambda: record_routes(redis_client, known, now_aware))
+        # (statuses 欄位, 日期, 是否為昨日清單, 額度優先序)，順序同單一查詢的 (昨日, 今日, 明日)
+        days = [("today", now_aware.strftime('%Y-%m-%d'), False, quota.PRIORITY_CRITICAL)]
+        if now_aware.hour < 4:
+            days.insert(0, ("yest", (now_aware - timedelta(days=1)).strftime('%Y-%m-%d'), True, quota.PRIORITY_NORMAL))
+        if want_next_day:
+            days.append(("tmrw", (now_aware + timedelta(days=1)).strftime('%Y-%m-%d'), False, quota.PRIORITY_PREFETCH))
+
+        f_delay = self.submit_delays(headers)
+        get_snapshot = self.timer.timed("timetable", self.get_route_snapshot)
+        futures = {}
+        for start_station, end_station in pairs:
+            start_id, end_id = STATION_MAP.get(start_station), STATION_MAP.get(end_station)
+            if not start_id or not end_id: continue
+            for _, date_str, fix, priority in days:
+                key = (start_id, end_id, date_str, fix)
+                if key not in futures:
+                    futures[key] = self.run_cached(get_snapshot, start_id, end_id, date_str, headers,
+                                                   fix_crossing_night=fix, priority=priority)
+
+        delays, delay_failed, delay_status, delay_version = self.delay_result(f_delay)
+        logging_enabled_resp = self.logging_flag(sid)
+
+        routes, all_statuses = [], {}
+        bounds = delay_bounds(delays)
+        for start_station, end_station in pairs:
+            start_id, end_id = STATION_MAP.get(start_station), STATION_MAP.get(end_station)
+            if not start_id or not end_id:
+                routes.append({"start": start_station, "end": end_station, "error": "Station Error"})
+                continue
+            statuses = {"today": "Skipped", "tmrw": "Skipped", "yest": "Skipped"}
+            snaps = []
+            try:
+                for field, date_str, fix, _ in days:
+                    snap, statuses[field] = futures[(start_id, end_id, date_str, fix)].result()
+                    snaps.append(snap)
+            except Exception as e:
+                routes.append({"start": start_station, "end": end_station, "error": str(e)})
+                continue
+            with self.timer.stage("process"):
+                result, _ = self.collect_trains(snaps, delays, now_aware, want_next_day, bounds)
+            routes.append({
+                "start": start_station, "end": end_station,
+                "trains": result, "stats": { "original_count": len(result) },
+                "diagnostics": { "route_status": self.route_status_text(statuses, now_aware, want_next_day) }
+            })
+            all_statuses.update({f"{start_id}_{end_id}_{k}": v for k, v in statuses.items()})
+        self.count_request(all_statuses, delay_status, False)
+
+        with self.timer.stage("process"):
+            body = json.dumps({
+                "batch": True, "update_time": now_aware.strftime("%H:%M:%S"),
+                "delay_failed": delay_failed, "delay_version": delay_version, "routes": routes,
+                "diagnostics": { "delay_status": delay_status, "cache": self.cache_stats.as_dict(),
+                                 "quota": self.quota_diagnostics() },
+                "logging_enabled": logging_enabled_resp
+            }).encode()
+
+        if sid:
+            log_entry = {"t": int(now_aware.timestamp()), "a": "Batch", "v2": delay_status,
+                         "r": [[r['start'], r['end'], r['stats']['original_count'] if "trains" in r else r["error"]]
+                               for r in routes]}
+            with self.timer.stage("log"):
+                log_to_redis_logic(log_entry, sid, defer=self.after_response if LOG_WRITE_BEHIND else None)
+
+        return (body, body_etag(body), False, QUERY_CACHE_CONTROL)
+
+    def do_board(self, station, hours, limit, sid):
+        """
+        車站看板：board=臺北 列出接下來 hours 小時內從該站出發的列車 (不分方向)，附終點站與即時誤點。
+        時刻表來自每日一次的全線時刻表 (與 ROUTE_SOURCE 無關)，各站的離站清單在行程內編譯一次後重複使用。
+        """
+        station_id = STATION_MAP.get(station)
+        if not station_id: raise Exception("Station Error")
+
+        headers = self.auth_headers()
+        now_aware = now_tw()
+        until_ts = now_aware.timestamp() + hours * 3600
+        # (statuses 欄位, 日期, 是否為昨日清單, 額度優先序)；時間窗跨過午夜才需要明日時刻表
+        days = [("today", now_aware.strftime('%Y-%m-%d'), False, quota.PRIORITY_CRITICAL)]
+        if now_aware.hour < 4:
+            days.insert(0, ("yest", (now_aware - timedelta(days=1)).strftime('%Y-%m-%d'), True, quota.PRIORITY_NORMAL))
+        if (now_aware + timedelta(hours=hours)).date() != now_aware.date():
+            days.append(("tmrw", (now_aware + timedelta(days=1)).strftime('%Y-%m-%d'), False, quota.PRIORITY_NORMAL))
+
+        f_delay = self.submit_delays(headers)
+        get_board = self.timer.timed("timetable", self.get_board_snapshot)
+        futures = [(field, self.run_cached(get_board, station_id, date_str, headers,
+                                           fix_crossing_night=fix, priority=priority))
+                   for field, date_str, fix, priority in days]
+
+        delays, delay_failed, delay_status, delay_version = self.delay_result(f_delay)
+        logging_enabled_resp = self.logging_flag(sid)
+
+        statuses = {"today": "Skipped", "tmrw": "Skipped", "yest": "Skipped"}
+        snaps, dests = [], {}
+        for field, f in futures:
+            board, statuses[field] = f.result()
+            if board:
+                snaps.append(board[0])
+                dests.update(board[1])
+        self.count_request(statuses, delay_status, False)
+
+        with self.timer.stage("process"):
+            # 只疊加看板時間窗 (剛開走 10 分鐘內 ~ hours 小時後) 的班次，不必算整天
+            window = (now_aware.timestamp() - PAST_GRACE_SEC, until_ts)
+            result, _ = self.collect_trains(snaps, delays, now_aware, want_next_day=True, window=window)
+            trains = result[:limit]
+            for p in trains:
+                dest_id = dests.get(p['no'])
+                p['to'] = STATION_NAME.get(dest_id, dest_id)
+
+            body = json.dumps({
+                "board": station, "update_time": now_aware.strftime("%H:%M:%S"),
+                "hours": hours, "delay_failed": delay_failed, "delay_version": delay_version,
+                "trains": trains, "stats": { "original_count": len(trains) },
+                "diagnostics": { "route_status": self.route_status_text(statuses, now_aware, len(days) > 1),
+                                 "delay_status": delay_status, "cache": self.cache_stats.as_dict(),
+                                 "quota": self.quota_diagnostics() },
+                "logging_enabled": logging_enabled_resp
+            }).encode()
+
+        if sid:
+            log_entry = {"t": int(now_aware.timestamp()), "a": "Board", "b": station, "h": hours,
+                         "n": len(trains), "v3": statuses['today'], "v2": delay_status}
+            with self.timer.stage("log"):
+                log_to_redis_logic(log_entry, sid, defer=self.after_response if LOG_WRITE_BEHIND else None)
+
+        return (body, body_etag(body), False, QUERY_CACHE_CONTROL)
+
+    def do_bundle(self, bundle_param, date_param):
+        """
+        離線時刻表包：bundle=臺北-板橋,板橋-臺北&date=YYYY-MM-DD (預設今天)
+        各組起訖站前一日 (跨夜修正後)、當日、隔日的表定班次，不含誤點。前端交給 service worker 快取，
+        之後只要再抓 delays=1 就能在本地算出跟一般查詢相同的清單。
+        每列為 [車次, 車種索引 (對應 "types"), 離站分鐘, 到站分鐘]，分鐘數由該日 00:00 ("base") 起算。
+        """
+        pairs = parse_route_pairs(bundle_param)
+        if not pairs: raise Exception("Station Error")
+        if len(pairs) > MAX_BATCH_ROUTES: raise Exception(f"Too Many Routes (max {MAX_BATCH_ROUTES})")
+
+        now_aware = now_tw()
+        today = now_aware.date()
+        try: day = datetime.strptime(date_param, '%Y-%m-%d').date() if date_param else today
+        except ValueError: raise Exception("Date Error")
+        # 只接受昨天 ~ 明天，避免任意日期吃掉額度
+        if abs((day - today).days) > 1: raise Exception("Date Error")
+
+        headers = self.auth_headers()
+        # (欄位, 日期, 是否為昨日清單, 額度優先序)
+        days = [("yest", (day - timedelta(days=1)).strftime('%Y-%m-%d'), True, quota.PRIORITY_NORMAL),
+                ("today", day.strftime('%Y-%m-%d'), False,
+                 quota.PRIORITY_CRITICAL if day == today else quota.PRIORITY_NORMAL),
+                ("tmrw", (day + timedelta(days=1)).strftime('%Y-%m-%d'), False, quota.PRIORITY_PREFETCH)]
+
+        get_snapshot = self.timer.timed("timetable", self.get_route_snapshot)
+        futures = {}
+        for start_station, end_station in pairs:
+            start_id, end_id = STATION_MAP.get(start_station), STATION_MAP.get(end_station)
+            if not start_id or not end_id: continue
+            for _, date_str, fix, priority in days:
+                futures[(start_id, end_id, date_str, fix)] = self.run_cached(
+                    get_snapshot, start_id, end_id, date_str, headers, fix_crossing_night=fix, priority=priority)
+
+        types, routes, all_statuses, complete = [], {}, {}, True
+        for start_station, end_station in pairs:
+            route_key = f"{start_station}-{end_station}"
+            start_id, end_id = STATION_MAP.get(start_station), STATION_MAP.get(end_station)
+            if not start_id or not end_id:
+                routes[route_key] = {"error": "Station Error"}
+                continue
+            entry = {}
+            try:
+                for field, date_str, fix, _ in days:
+                    snap, all_statuses[f"{start_id}_{end_id}_{field}"] = futures[(start_id, end_id, date_str, fix)].result()
+                    if snap is None:
+                        complete = False
+                        continue
+                    with self.timer.stage("process"):
+                        entry[field] = {"date": date_str, "base": snap.base_ts, "rows": snapshot_rows(snap, types)}
+            except Exception as e:
+                entry, complete = {"error": str(e)}, False
+            routes[route_key] = entry
+        self.count_request(all_statuses, "Skipped", False)
+
+        with self.timer.stage("process"):
+            payload = {"date": day.strftime('%Y-%m-%d'), "types": types, "routes": routes}
+            # 版本 = 內容雜湊：時刻表沒變，各 instance 產生的版本 (ETag) 都一樣
+            version = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:20]
+            body = json.dumps({"bundle": 1, "version": version, **payload}).encode()
+        return (body, f'"{version}"', False, BUNDLE_CACHE_CONTROL if complete else BUNDLE_PARTIAL_CACHE_CONTROL)
+
+    def do_delay_feed(self):
+        """
+        即時誤點 (delays=1)：只列出有誤點的車次，給已持有時刻表包的前端使用。
+        內容與查詢的起訖站無關、所有人共用同一份，交給 CDN 快取。
+        """
+        headers = self.auth_headers()
+        now_aware = now_tw()
+        delays, delay_failed, delay_status, delay_version = self.delay_result(self.submit_delays(headers))
+        self.count_request({}, delay_status, False)
+
+        with self.timer.stage("process"):
+            body = json.dumps({
+                "delay_version": delay_version, "update_time": now_aware.strftime("%H:%M:%S"),
+                "delay_failed": delay_failed, "delays": {no: d for no, d in delays.items() if d},
+                "diagnostics": { "delay_status": delay_status, "cache": self.cache_stats.as_dict(),
+                                 "quota": self.quota_diagnostics() }
+            }).encode()
+        return (body, body_etag(body), False, 'no-cache' if delay_failed else DELAY_FEED_CACHE_CONTROL)
+
+    def do_ping(self, start_station, end_station, want_next_day, sid, raw_mode, count):
+        """
+        前端用時刻表包在本地算出清單後補送的輕量回報 (ping=1)：不打 TDX、不查時刻表，
+        只記路線熱門度與 Session Log，讓走時刻表包的開啟 / 重新整理跟一般查詢一樣被統計。
+        """
+        start_id = STATION_MAP.get(start_station)
+        end_id = STATION_MAP.get(end_station)
+        if not start_id or not end_id: raise Exception("Station Error")
+
+        now_aware = now_tw()
+        self.after_response.append(lambda: record_routes(redis_client, [(start_id, end_id)], now_aware))
+        logging_enabled_resp = self.logging_flag(sid)
+        if sid:
+            log_entry = {"t": int(now_aware.timestamp()), "a": f"{raw_mode.capitalize()}(Bundle)",
+                         "r": [[start_station, end_station, count]],
+                         "v3": "Bundle" + (" +Tmrw" if want_next_day else ""), "v2": "Delay Feed"}
+            with self.timer.stage("log"):
+                log_to_redis_logic(log_entry, sid, defer=self.after_response if LOG_WRITE_BEHIND else None)
+        body = json.dumps({"ok": True, "logging_enabled": logging_enabled_resp}).encode()
+        return (body, None, False, PING_CACHE_CONTROL)
+
+    def init_request_state(self):
+        self.cache_stats = CacheStats()
+        self.refreshes = []
+        self.after_response = []
+        self.timer = StageTimer()
+        self.quota_state = quota.tracker.state(redis_client)
+
+    def warm_routes(self, top_n=WARMUP_TOP_N, budget=WARMUP_BUDGET, date_str=None, compile_snapshots=True):
+        """
+        預先把熱門路線某一天 (預設為下一個營運日) 的時刻表抓進 Redis，最多打 budget 次 TDX。
+        已經在快取裡的路線不花額度；bulk 模式一次全線時刻表就涵蓋所有路線。
+        compile_snapshots=False 只寫 Redis (warmup.py 的行程跑完就結束，編譯好的快照留不下來)。
+        upstream_calls 是實際打出去的 TDX 呼叫數 (含 token)，被額度擋下的不算。
+        """
+        now_aware = now_tw()
+        # 凌晨 4 點前 (例如 cron 01:30) 當天的早班車還沒開，預熱今天；之後才預熱明天
+        date_str = date_str or (now_aware + timedelta(days=0 if now_aware.hour < 4 else 1)).strftime('%Y-%m-%d')
+        ranked = top_routes(redis_client, top_n, now_aware) if redis_client else []
+        result = {"date": date_str, "budget": budget, "upstream_calls": 0, "routes": [], "over_budget": []}
+        if not ranked: return result
+
+        token = self.get_token(CLIENT_ID, CLIENT_SECRET)
+        if not token: raise Exception("Auth Failed")
+        headers = {'authorization': f'Bearer {token}'}
+
+        def warm_one(start_id, end_id):
+            if compile_snapshots:
+                snap, status = self.get_route_snapshot(start_id, end_id, date_str, headers, priority=quota.PRIORITY_NORMAL)
+                return (len(snap) if snap else 0, status)
+            rows, status = self.get_route_timetable(start_id, end_id, date_str, headers, priority=quota.PRIORITY_NORMAL)
+            return (len(rows), status) if rows is not None else (0, "Quota Skip")
+
+        def is_fresh(key, l1, decode):
+            # 只讀快取，已經新鮮的不需要花預算
+            _, source = swr_get(redis_client, key, None, soft_ttl=0, hard_ttl=0, l1=l1, decode=decode)
+            return source in ("L1", "L2")
+
+        remaining, upstream_calls = budget, 0
+        if ROUTE_SOURCE == 'bulk':
+            # 全線時刻表一次涵蓋所有路線，只需要一次額度
+            if not is_fresh(f"v3_daily_{date_str}", _daily_index_l1, decode_daily_index):
+                if remaining <= 0:
+                    result["over_budget"] = [f"{a}_{b}" for (a, b), _ in ranked]
+                    return result
+                remaining -= 1
+            index, daily_status = self.get_daily_index(date_str, headers, quota.PRIORITY_NORMAL)
+            if index is None: daily_status = "Quota Skip"
+            elif daily_status.startswith("API"): upstream_calls += 1
+            if not compile_snapshots:
+                # 路線都從同一份全線索引求得，Redis 裡有這份就夠了
+                result["routes"] = [{"route": f"{a}_{b}", "queries": count, "status": daily_status}
+                                    for (a, b), count in ranked]
+                result["upstream_calls"] = upstream_calls + self.timer.counters.get("token_fetch", 0)
+                drain_refreshes(self.refreshes)
+                return result
+
+        futures = []
+        for (start_id, end_id), count in ranked:
+            entry = {"route": f"{start_id}_{end_id}", "queries": count}
+            if ROUTE_SOURCE != 'bulk' and not is_fresh(f"v3_route_{start_id}_{end_id}_{date_str}", None, decode_route_rows):
+                if remaining <= 0:
+                    result["over_budget"].append(entry["route"])
+                    continue
+                remaining -= 1
+            futures.append((entry, upstream.submit(warm_one, start_id, end_id)))
+
+        for entry, f in futures:
+            try: entry["trains"], entry["status"] = f.result()
+            except Exception as e: entry["error"] = str(e)
+            if ROUTE_SOURCE != 'bulk' and entry.get("status", "").startswith("API"): upstream_calls += 1
+            result["routes"].append(entry)
+        result["upstream_calls"] = upstream_calls + self.timer.counters.get("token_fetch", 0)
+        drain_refreshes(self.refreshes)
+        return result
+
+    def run_after_response(self):
+        for task in self.after_response:
+            try: task()
+            except Exception as e: print(f"After Response Error: {e}")
+        self.after_response = []
 
-    def send_error_response(self, msg):
-        self.send_response(500)
+    def send_error_response(self, msg, status=500):
+        self.send_response(status)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
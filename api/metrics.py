@@ -0,0 +1,138 @@
+# api/metrics.py
+# 每個請求的分段計時：
+# 1. 回應帶 Server-Timing header，瀏覽器 DevTools 直接看得到各階段花多少時間
+# 2. 回應送出後把這次的耗時丟進 Redis 的每分鐘直方圖 (固定 bucket，一個 hash、一個 pipeline)
+# 3. 上帝模式 action=metrics 讀最近 60 分鐘的 hash，合併後估算各階段的 p50 / p95 / p99
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_PREFIX = "metrics:"
+WINDOW_SEC = 60
+KEEP_SEC = 7200
+# 直方圖上界 (ms)，最後一格是 +inf
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SUMMARY_WINDOWS_MIN = (5, 15, 60)
+
+
+def bucket_index(ms):
+    return bisect_left(BUCKETS_MS, ms)
+
+
+def bucket_label(idx):
+    return f"<={BUCKETS_MS[idx]}" if idx < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}"
+
+
+class StageTimer:
+    """
+    單一請求的分段耗時 (ms) 與計數器。
+    同名階段重複記錄時取最大值：昨日 / 今日 / 明日時刻表是平行抓的，時間互相重疊。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self.durations = {}
+        self.counters = {}
+
+    def add(self, name, ms):
+        with self._lock:
+            self.durations[name] = max(self.durations.get(name, 0.0), ms)
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.add(name, (time.perf_counter() - t0) * 1000)
+
+    def timed(self, name, fn):
+        """包裝要丟進 thread pool 的函式"""
+        def run(*args, **kwargs):
+            with self.stage(name): return fn(*args, **kwargs)
+        return run
+
+    def finish(self):
+        """記錄從建立到現在的總時間"""
+        self.add("total", (time.perf_counter() - self._t0) * 1000)
+
+    def server_timing(self):
+        with self._lock:
+            return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.durations.items())
+
+    def flush(self, r, now=None):
+        """寫進這一分鐘的直方圖 hash，整批一趟 pipeline"""
+        if not r: return
+        with self._lock:
+            durations, counters = dict(self.durations), dict(self.counters)
+        key = f"{METRICS_PREFIX}{int((now or time.time()) // WINDOW_SEC)}"
+        pipe = r.pipeline(transaction=False)
+        for name, ms in durations.items():
+            pipe.hincrby(key, f"{name}|{bucket_index(ms)}", 1)
+            pipe.hincrby(key, f"{name}|sum_us", int(ms * 1000))
+        for name, n in counters.items():
+            pipe.hincrby(key, f"#{name}", n)
+        pipe.expire(key, KEEP_SEC)
+        pipe.execute()
+
+
+def _percentile(buckets, total, p):
+    """回傳該百分位落在的 bucket 上界 (ms)；落在最後一格回傳 None"""
+    target = total * p / 100
+    seen = 0
+    for idx in range(len(BUCKETS_MS) + 1):
+        seen += buckets.get(idx, 0)
+        if seen >= target and seen > 0:
+            return BUCKETS_MS[idx] if idx < len(BUCKETS_MS) else None
+    return None
+
+
+def summarize(r, windows_min=SUMMARY_WINDOWS_MIN, now=None):
+    """
+    {"5m": {"requests": n, "stages": {階段: {count, mean_ms, p50, p95, p99, buckets}}, "counters": {...}}, ...}
+    百分位是 bucket 上界 (估計值)，None 代表超過最大 bucket。
+    """
+    current = int((now or time.time()) // WINDOW_SEC)
+    span = max(windows_min)
+    pipe = r.pipeline(transaction=False)
+    for i in range(span): pipe.hgetall(f"{METRICS_PREFIX}{current - i}")
+    minutes = pipe.execute()
+
+    result = {}
+    for w in windows_min:
+        hist, sums, counters = {}, {}, {}
+        for raw in minutes[:w]:
+            for field, val in raw.items():
+                field, val = field.decode('utf-8'), int(val)
+                if field.startswith("#"):
+                    counters[field[1:]] = counters.get(field[1:], 0) + val
+                    continue
+                name, slot = field.rsplit("|", 1)
+                if slot == "sum_us":
+                    sums[name] = sums.get(name, 0) + val
+                else:
+                    b = hist.setdefault(name, {})
+                    b[int(slot)] = b.get(int(slot), 0) + val
+
+        stages = {}
+        for name, buckets in hist.items():
+            count = sum(buckets.values())
+            stages[name] = {
+                "count": count,
+                "mean_ms": round(sums.get(name, 0) / 1000 / count, 2),
+                "p50": _percentile(buckets, count, 50),
+                "p95": _percentile(buckets, count, 95),
+                "p99": _percentile(buckets, count, 99),
+                "buckets": {bucket_label(i): n for i, n in sorted(buckets.items())},
+            }
+        result[f"{w}m"] = {
+            "requests": stages.get("total", {}).get("count", 0),
+            "stages": stages,
+            "counters": counters,
+        }
+    return result
@@ -0,0 +1,38 @@
+# api/popularity.py
+# 起訖站查詢熱度：每天一個 sorted set (member = "起站ID_迄站ID", score = 查詢次數)，保留 POPULARITY_DAYS 天。
+# 查詢時只多一個 ZINCRBY (跟 EXPIRE 包成一個 pipeline，在回應送出後才寫)；
+# 預熱 (warmup) 讀最近幾天加總後的前 N 名。
+
+from datetime import datetime, timedelta
+
+POPULARITY_PREFIX = "pop:routes:"
+POPULARITY_DAYS = 7
+TOP_SCAN = 200
+
+
+def _key(day):
+    return f"{POPULARITY_PREFIX}{day.strftime('%Y%m%d')}"
+
+
+def record_routes(r, pairs, now_aware):
+    """pairs = [(start_id, end_id), ...]"""
+    if not r or not pairs: return
+    key = _key(now_aware)
+    pipe = r.pipeline(transaction=False)
+    for start_id, end_id in pairs: pipe.zincrby(key, 1, f"{start_id}_{end_id}")
+    pipe.expire(key, (POPULARITY_DAYS + 1) * 86400)
+    pipe.execute()
+
+
+def top_routes(r, n, now_aware=None, days=POPULARITY_DAYS):
+    """最近 days 天加總的前 n 名，回傳 [((start_id, end_id), count), ...]"""
+    now_aware = now_aware or datetime.now()
+    pipe = r.pipeline(transaction=False)
+    for i in range(days): pipe.zrevrange(_key(now_aware - timedelta(days=i)), 0, TOP_SCAN - 1, withscores=True)
+    totals = {}
+    for members in pipe.execute():
+        for m, score in members:
+            m = m.decode('utf-8')
+            totals[m] = totals.get(m, 0) + score
+    ranked = sorted(totals.items(), key=lambda x: -x[1])[:n]
+    return [(tuple(m.split("_", 1)), int(score)) for m, score in ranked]
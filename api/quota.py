@@ -0,0 +1,113 @@
+# api/quota.py
+# TDX 額度追蹤：
+# 每次 TDX 回應都把「剩餘額度」header 記進 Redis (所有 instance 共用)，依剩餘量分級：
+#   normal    -> 照常
+#   low       -> 跳過預抓 (明日時刻表)，快取新鮮時間 x2
+#   critical  -> 只打最重要的呼叫 (今日時刻表)，快取新鮮時間 x4
+#   exhausted -> 收到 429 後冷卻期間完全不打，只回快取 (含過期資料)
+# 被擋下的呼叫改成只讀快取，swr_get 會回傳過期但仍保留在 Redis 的資料 (stale_ttl)。
+
+import os
+import threading
+import time
+
+QUOTA_KEY = "quota:tdx"
+QUOTA_LOW = int(os.environ.get('QUOTA_LOW', '2000'))
+QUOTA_CRITICAL = int(os.environ.get('QUOTA_CRITICAL', '300'))
+EXHAUSTED_COOLDOWN = 60
+STATE_TTL = 5
+
+# 呼叫優先序：數字越小越重要
+PRIORITY_CRITICAL = 0   # 今日時刻表
+PRIORITY_NORMAL = 1     # 即時誤點、凌晨的昨日時刻表
+PRIORITY_PREFETCH = 2   # 明日時刻表
+
+# 等級 -> (允許的最大優先序數字, 快取 TTL 倍率)
+POLICY = {
+    "normal": (PRIORITY_PREFETCH, 1),
+    "low": (PRIORITY_NORMAL, 2),
+    "critical": (PRIORITY_CRITICAL, 4),
+    "exhausted": (-1, 8),
+}
+
+
+def parse_remaining(res):
+    """回應 header 裡的剩餘額度，沒有或無法解析回傳 None"""
+    for k, v in res.headers.items():
+        if 'remaining' in k.lower():
+            try: return int(v)
+            except ValueError: return None
+    return None
+
+
+def level_for(remaining, exhausted_until=0, now=None):
+    if exhausted_until > (now or time.time()): return "exhausted"
+    if remaining is None: return "normal"
+    if remaining <= 0: return "exhausted"
+    if remaining < QUOTA_CRITICAL: return "critical"
+    if remaining < QUOTA_LOW: return "low"
+    return "normal"
+
+
+class QuotaTracker:
+    """目前額度狀態在行程內快取 STATE_TTL 秒，避免每次請求都多一趟 Redis"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._loaded_at = 0.0
+
+    def observe(self, r, res):
+        """記錄一次 TDX 回應；429 進入冷卻"""
+        remaining = parse_remaining(res)
+        exhausted_until = 0
+        if res.status_code == 429:
+            try: cooldown = int(res.headers.get('Retry-After', EXHAUSTED_COOLDOWN))
+            except ValueError: cooldown = EXHAUSTED_COOLDOWN
+            exhausted_until = time.time() + cooldown
+        if remaining is None and not exhausted_until: return
+
+        now = time.time()
+        state = {"remaining": remaining, "exhausted_until": exhausted_until, "updated": now}
+        with self._lock:
+            self._state, self._loaded_at = state, now
+        if r:
+            mapping = {"remaining": "" if state["remaining"] is None else state["remaining"],
+                       "exhausted_until": state["exhausted_until"], "updated": now}
+            try: r.hset(QUOTA_KEY, mapping=mapping)
+            except Exception as e: print(f"Quota Error: {e}")
+
+    def state(self, r):
+        """{"remaining", "level", "updated"}"""
+        now = time.time()
+        with self._lock:
+            state = self._state if now - self._loaded_at < STATE_TTL else None
+        if state is None:
+            state = {"remaining": None, "exhausted_until": 0, "updated": None}
+            if r:
+                try:
+                    raw = {k.decode('utf-8'): v.decode('utf-8') for k, v in (r.hgetall(QUOTA_KEY) or {}).items()}
+                    if raw.get("updated"):
+                        state = {"remaining": int(raw["remaining"]) if raw.get("remaining") else None,
+                                 "exhausted_until": float(raw.get("exhausted_until") or 0),
+                                 "updated": float(raw["updated"])}
+                except Exception as e: print(f"Quota Error: {e}")
+            with self._lock:
+                self._state, self._loaded_at = state, now
+        return {"remaining": state["remaining"], "updated": state["updated"],
+                "level": level_for(state["remaining"], state["exhausted_until"], now)}
+
+    def reset(self):
+        with self._lock:
+            self._state, self._loaded_at = None, 0.0
+
+
+def allows(level, priority):
+    return priority <= POLICY[level][0]
+
+
+def ttl_factor(level):
+    return POLICY[level][1]
+
+
+tracker = QuotaTracker()
@@ -0,0 +1,173 @@
+# api/snapshot.py
+# 預先編譯的路線快照：
+# 同一組 (起站, 迄站, 日期) 的時刻表每次請求都一樣，只有誤點與「現在時間」會變。
+# 把車種分類、時間解析、跨日修正一次做完存成陣列，每次請求只剩誤點疊加 + 過站判斷。
+# 陣列依表定發車時間排序：超出時間窗的清單 (昨日跨夜、看板) 用 bisect 切出候選範圍，不必整份疊加誤點。
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+
+TW_TZ = timezone(timedelta(hours=8))
+
+# 依序比對，先符合者優先 (區間快 要在 區間 前面，3000 要在 自強 前面)
+TRAIN_TYPES = [
+    ("區間快", "區間快", "#0076B2"),
+    ("區間", "區間車", "#0076B2"),
+    ("普悠瑪", "普悠瑪", "#9C1637"),
+    ("3000", "自強3000", "#ffffff"),
+    ("自強", "自強號", "#DF3F1F"),
+    ("太魯閣", "太魯閣", "#9C1637"),
+    ("莒光", "莒光號", "#FF8C00"),
+]
+DEFAULT_COLOR = "#ffffff"
+
+# 誤點只套用在 6 小時內發車的班次；發車 10 分鐘後視為過站
+DELAY_HORIZON_MIN = 360
+PAST_GRACE_SEC = 600
+
+HHMM = [f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)]
+
+
+def classify_type(raw_type):
+    """回傳 (顯示名稱, 顏色)，都不符合就用原始名稱"""
+    for keyword, display, color in TRAIN_TYPES:
+        if keyword in raw_type: return (display, color)
+    return (raw_type, DEFAULT_COLOR)
+
+
+def _to_min(hhmm):
+    return int(hhmm[:2]) * 60 + int(hhmm[3:5])
+
+
+class RouteSnapshot:
+    """一組起訖站某一天的班次，時間以「該日 00:00 起算的分鐘數」存放"""
+
+    __slots__ = ("date_str", "base_ts", "nos", "type_idx", "types", "dep_min", "arr_min",
+                 "sch_dep", "sch_arr", "_dates")
+
+    def __init__(self, date_str):
+        self.date_str = date_str
+        base = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=TW_TZ)
+        self.base_ts = int(base.timestamp())
+        self.nos = []
+        self.type_idx = array('B')
+        self.types = []
+        self.dep_min = array('i')
+        self.arr_min = array('i')
+        self.sch_dep = []
+        self.sch_arr = []
+        self._dates = {}
+
+    def __len__(self):
+        return len(self.nos)
+
+    def add(self, no, display_type, color, dep_time, arr_time, dep_min, arr_min):
+        t = (display_type, color)
+        try: idx = self.types.index(t)
+        except ValueError:
+            idx = len(self.types)
+            self.types.append(t)
+        self.nos.append(no)
+        self.type_idx.append(idx)
+        self.sch_dep.append(dep_time)
+        self.sch_arr.append(arr_time)
+        self.dep_min.append(dep_min)
+        self.arr_min.append(arr_min)
+
+    def date_for(self, day_offset):
+        d = self._dates.get(day_offset)
+        if d is None:
+            d = (datetime.strptime(self.date_str, "%Y-%m-%d") + timedelta(days=day_offset)).strftime("%Y-%m-%d")
+            self._dates[day_offset] = d
+        return d
+
+
+def compile_route(rows, date_str, fix_crossing_night=False):
+    """路線列 [(車次, 車種名稱, 離站, 到站), ...] -> RouteSnapshot (依表定發車時間排序)"""
+    compiled = []
+    for no, raw_type, dep_time, arr_time in rows:
+        dep_min, arr_min = _to_min(dep_time), _to_min(arr_time)
+        # 昨日清單：中午前的時間其實是隔天凌晨
+        if fix_crossing_night:
+            if dep_time < "12:00": dep_min += 1440
+            if arr_time < "12:00": arr_min += 1440
+        if arr_min < dep_min: arr_min += 1440
+        compiled.append((dep_min, no, raw_type, dep_time, arr_time, arr_min))
+
+    compiled.sort(key=lambda r: r[0])
+    snap = RouteSnapshot(date_str)
+    for dep_min, no, raw_type, dep_time, arr_time, arr_min in compiled:
+        display_type, color = classify_type(raw_type)
+        snap.add(no, display_type, color, dep_time, arr_time, dep_min, arr_min)
+    return snap
+
+
+def snapshot_rows(snap, types):
+    """
+    RouteSnapshot -> [[車次, 車種索引, 離站分鐘, 到站分鐘], ...] (給離線時刻表包用)
+    車種索引指向呼叫端共用的 types 清單 [(顯示名稱, 顏色), ...]，沒有的會就地加進去。
+    """
+    remap = []
+    for t in snap.types:
+        try: remap.append(types.index(t))
+        except ValueError:
+            remap.append(len(types))
+            types.append(t)
+    return [[no, remap[t], d, a] for no, t, d, a in zip(snap.nos, snap.type_idx, snap.dep_min, snap.arr_min)]
+
+
+def delay_bounds(delays):
+    """誤點分鐘數的 (最小值, 最大值)，一定包含 0 (6 小時外的班次不套誤點)"""
+    lo = hi = 0
+    for d in delays.values():
+        d = int(d)
+        if d < lo: lo = d
+        elif d > hi: hi = d
+    return (lo, hi)
+
+
+def window_range(snap, start_ts, end_ts, min_delay=0, max_delay=0):
+    """
+    回傳 (lo, hi)：只有第 lo ~ hi-1 班疊加 [min_delay, max_delay] 分鐘誤點後，實際發車有可能落在
+    [start_ts, end_ts]；範圍外的不論誤點多少都一定在時間窗外，不必疊加。
+    """
+    base_ts = snap.base_ts
+    lo = bisect_left(snap.dep_min, math.ceil((start_ts - base_ts) / 60) - max_delay)
+    hi = bisect_right(snap.dep_min, math.floor((end_ts - base_ts) / 60) - min_delay)
+    return (lo, max(lo, hi))
+
+
+def delay_span(snap, min_delay=0, max_delay=0):
+    """疊加 [min_delay, max_delay] 分鐘誤點後，這份快照實際發車時間可能的 (最早, 最晚)；空快照回傳 None"""
+    if not len(snap): return None
+    return (snap.base_ts + (snap.dep_min[0] + min_delay) * 60, snap.base_ts + (snap.dep_min[-1] + max_delay) * 60)
+
+
+def overlay_delays(snap, delays, now_ts, lo=0, hi=None):
+    """疊加誤點 (只處理第 lo ~ hi-1 班)，輸出與舊版 process_daily_list 相同格式的 dict 清單"""
+    base_ts = snap.base_ts
+    horizon = now_ts + DELAY_HORIZON_MIN * 60
+    past_limit = now_ts - PAST_GRACE_SEC
+    nos, type_idx, types = snap.nos, snap.type_idx, snap.types
+    dep_min, arr_min, sch_dep, sch_arr = snap.dep_min, snap.arr_min, snap.sch_dep, snap.sch_arr
+    date_for = snap.date_for
+    get_delay = delays.get
+
+    processed = []
+    for i in range(lo, len(nos) if hi is None else hi):
+        no = nos[i]
+        d_min = dep_min[i]
+        delay = int(get_delay(no, 0)) if base_ts + d_min * 60 <= horizon else 0
+        real_dep = d_min + delay
+        real_arr = arr_min[i] + delay
+        sort_key = float(base_ts + real_dep * 60)
+        display_type, color = types[type_idx[i]]
+        processed.append({
+            "no": no, "type": display_type, "delay": delay, "color": color,
+            "act_dep": HHMM[real_dep % 1440], "act_arr": HHMM[real_arr % 1440],
+            "dep_date": date_for(real_dep // 1440), "arr_date": date_for(real_arr // 1440),
+            "sch_dep": sch_dep[i], "sch_arr": sch_arr[i], "sort_key": sort_key, "is_past": sort_key < past_limit
+        })
+    return processed
@@ -78,4 +78,8 @@ STATION_MAP = {
     "合興": "1208", "富貴": "1209", "內灣": "1210",
     "源泉": "3431", "濁水": "3432", "龍泉": "3433", "集集": "3434", "水里": "3435", "車埕": "3436",
     "長榮大學": "4271", "沙崙": "4272"
-}
\ No newline at end of file
+}
+
+# 站ID -> 站名 (同一個 ID 有多個名稱時取第一個)
+STATION_NAME = {}
+for _name, _sid in STATION_MAP.items(): STATION_NAME.setdefault(_sid, _name)
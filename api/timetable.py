@@ -0,0 +1,162 @@
+# api/timetable.py
+# 全線每日時刻表索引：
+# 每個營運日只呼叫一次 DailyTrainTimetable/TrainDate，之後任意起訖站都在本地用
+# 「兩站車次交集 + 停靠順序」求解，不再每組 OD 各打一次 TDX、各存一份 Redis。
+#
+# 起訖站時刻表統一用「路線列」表示：[(車次, 車種名稱, 起站離站時間, 迄站到站時間), ...]
+# 只留實際會用到的兩站，存 Redis 時再壓成二進位 (encode_route_rows)。
+
+import itertools
+import json
+import struct
+import zlib
+
+INDEX_VERSION = 1
+
+# 每份載入到記憶體的索引一個世代編號 (見 load_daily_index)
+_index_gen = itertools.count(1)
+
+# 路線列二進位格式：
+#   b"RT" + 版本(1B) + 車種數(2B) + [長度(1B) + 車種名稱]... + 班次數(2B)
+#   + [車次長度(1B) + 車次 + 車種索引(1B) + 離站分鐘(2B) + 到站分鐘(2B)]...
+ROUTE_MAGIC = b"RT"
+ROUTE_VERSION = 2
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_ROW_TAIL = struct.Struct("<BHH")
+
+
+def build_daily_index(raw_list):
+    """把 TDX 全線時刻表壓成 {車次: [車種名稱, [[站ID, 到站, 離站], ...]]}"""
+    trains = {}
+    for item in raw_list:
+        info = item.get('TrainInfo', {})
+        no = info.get('TrainNo')
+        if not no: continue
+        raw_type = info.get('TrainTypeName', {}).get('Zh_tw', '')
+        stop_times = sorted(item.get('StopTimes', []), key=lambda s: s.get('StopSequence', 0))
+        stops = [[s.get('StationID'), s.get('ArrivalTime'), s.get('DepartureTime')] for s in stop_times]
+        trains[no] = [raw_type, stops]
+    return load_daily_index({"v": INDEX_VERSION, "trains": trains})
+
+
+def load_daily_index(data):
+    """
+    補上 站ID -> {車次: 停靠順序} 的反查表與世代編號 "gen" (都只存在記憶體，不寫進 Redis)。
+    由索引衍生的 L1 (路線快照、車站看板) 只記 gen，索引被換掉後舊的那份才能被回收。
+    """
+    stations = {}
+    for no, (_, stops) in data["trains"].items():
+        for seq, stop in enumerate(stops):
+            stations.setdefault(stop[0], {}).setdefault(no, seq)
+    data["stations"] = stations
+    data["gen"] = next(_index_gen)
+    return data
+
+
+def encode_daily_index(index):
+    payload = {"v": INDEX_VERSION, "trains": index["trains"]}
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_daily_index(blob):
+    """版本不符回傳 None，呼叫端視為 cache miss"""
+    data = json.loads(zlib.decompress(blob).decode('utf-8'))
+    if data.get("v") != INDEX_VERSION: return None
+    return load_daily_index(data)
+
+
+def normalize_od(raw_list, start_id, end_id):
+    """DailyTrainTimetable/OD 的 TrainTimetables -> 路線列 (丟掉中間停靠站)"""
+    rows = []
+    for item in raw_list:
+        info = item.get('TrainInfo', {})
+        no = info.get('TrainNo')
+        raw_type = info.get('TrainTypeName', {}).get('Zh_tw', '')
+        dep_time, arr_time = None, None
+        for stop in item.get('StopTimes', []):
+            s_id = stop.get('StationID')
+            if s_id == start_id: dep_time = stop.get('DepartureTime')
+            elif s_id == end_id: arr_time = stop.get('ArrivalTime')
+        if not no or not dep_time or not arr_time: continue
+        rows.append((no, raw_type, dep_time, arr_time))
+    rows.sort(key=lambda r: r[2])
+    return rows
+
+
+def query_od(index, start_id, end_id):
+    """由全線索引求出起訖站的路線列 (依起站離站時間排序)"""
+    from_start = index["stations"].get(start_id)
+    to_end = index["stations"].get(end_id)
+    if not from_start or not to_end: return []
+
+    rows = []
+    for no in from_start.keys() & to_end.keys():
+        dep_seq, arr_seq = from_start[no], to_end[no]
+        if dep_seq >= arr_seq: continue
+        raw_type, stops = index["trains"][no]
+        dep_time, arr_time = stops[dep_seq][2], stops[arr_seq][1]
+        if not dep_time or not arr_time: continue
+        rows.append((no, raw_type, dep_time, arr_time))
+    rows.sort(key=lambda r: r[2])
+    return rows
+
+
+def query_departures(index, station_id):
+    """
+    由全線索引求出某站所有離站班次 (不分方向)，依離站時間排序：
+    [(車次, 車種名稱, 離站時間, 終點站到站時間, 終點站ID), ...]；以該站為終點的班次不列入
+    """
+    seqs = index["stations"].get(station_id)
+    if not seqs: return []
+
+    rows = []
+    for no, seq in seqs.items():
+        raw_type, stops = index["trains"][no]
+        if seq >= len(stops) - 1: continue
+        dep_time, (last_id, last_arr, _) = stops[seq][2], stops[-1]
+        if not dep_time or not last_arr: continue
+        rows.append((no, raw_type, dep_time, last_arr, last_id))
+    rows.sort(key=lambda r: r[2])
+    return rows
+
+
+def _to_min(hhmm):
+    return int(hhmm[:2]) * 60 + int(hhmm[3:5])
+
+
+def _to_hhmm(m):
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+def encode_route_rows(rows):
+    types = list(dict.fromkeys(r[1] for r in rows))
+    type_idx = {t: i for i, t in enumerate(types)}
+    out = [ROUTE_MAGIC, _U8.pack(ROUTE_VERSION), _U16.pack(len(types))]
+    for t in types:
+        b = t.encode('utf-8')
+        out.append(_U8.pack(len(b)) + b)
+    out.append(_U16.pack(len(rows)))
+    for no, raw_type, dep_time, arr_time in rows:
+        b = no.encode('utf-8')
+        out.append(_U8.pack(len(b)) + b + _ROW_TAIL.pack(type_idx[raw_type], _to_min(dep_time), _to_min(arr_time)))
+    return b"".join(out)
+
+
+def decode_route_rows(blob):
+    """版本不符 (含舊版 JSON) 回傳 None，呼叫端視為 cache miss"""
+    if blob[:3] != ROUTE_MAGIC + _U8.pack(ROUTE_VERSION): return None
+    pos = 3
+    (n_types,) = _U16.unpack_from(blob, pos); pos += 2
+    types = []
+    for _ in range(n_types):
+        n = blob[pos]; pos += 1
+        types.append(blob[pos:pos + n].decode('utf-8')); pos += n
+    (n_rows,) = _U16.unpack_from(blob, pos); pos += 2
+    rows = []
+    for _ in range(n_rows):
+        n = blob[pos]; pos += 1
+        no = blob[pos:pos + n].decode('utf-8'); pos += n
+        t, dep_min, arr_min = _ROW_TAIL.unpack_from(blob, pos); pos += _ROW_TAIL.size
+        rows.append((no, types[t], _to_hhmm(dep_min), _to_hhmm(arr_min)))
+    return rows
@@ -0,0 +1,101 @@
+# api/upstream.py
+# 共用的 TDX HTTP client：
+# 1. 全行程共用一個 requests.Session (keep-alive + 連線池)
+# 2. 每次呼叫都有 connect / read timeout
+# 3. 連線錯誤與 5xx 會退避重試，但受重試預算限制，避免 TDX 出狀況時重試把流量放大；
+#    429 (額度用完) 不重試：重試只會再扣額度，直接交給 quota.tracker 依 Retry-After 冷卻
+# 4. 互不相依的呼叫丟到共用 thread pool 平行執行 (大小用 UPSTREAM_WORKERS 或 set_pool_size 設定)
+# 5. requests 在第一次真的要打上游時才載入 (全部快取命中的請求、冷啟動的 import 都省掉這段)
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.2
+RETRY_STATUS = {500, 502, 503, 504}
+POOL_SIZE = 16
+UPSTREAM_WORKERS = int(os.environ.get('UPSTREAM_WORKERS', '8'))
+
+_session = None
+_session_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+
+
+class RetryBudget:
+    """每個請求存 ratio 次重試額度，最多存 max_tokens 次；重試一次扣 1"""
+
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1: return False
+            self.tokens -= 1
+            return True
+
+
+retry_budget = RetryBudget()
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def request(method, url, timeout=None, retries=MAX_RETRIES, **kwargs):
+    import requests
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    retry_budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            res = get_session().request(method, url, timeout=timeout, **kwargs)
+            if res.status_code not in RETRY_STATUS or attempt >= retries or not retry_budget.withdraw():
+                return res
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries or not retry_budget.withdraw(): raise
+        attempt += 1
+        # 指數退避 + jitter
+        time.sleep(BACKOFF_BASE * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def set_pool_size(workers):
+    """換一個 workers 條執行緒的 pool (自架時配合 HTTP worker 數)；舊 pool 做完手上的工作後結束"""
+    global _executor
+    old, _executor = _executor, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upstream")
+    old.shutdown(wait=False)
+
+
+def submit(fn, *args, **kwargs):
+    """丟進共用 thread pool，回傳 Future (呼叫端用 .result() 取值或拿到例外)"""
+    return _executor.submit(fn, *args, **kwargs)
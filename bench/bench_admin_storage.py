@@ -0,0 +1,87 @@
+# bench/bench_admin_storage.py
+# 上帝模式資料的 Redis 用量報告：
+#   session:{sid}  舊版多行文字 Log vs 精簡 JSON 欄位 (讀取時才排版)
+#   report:*       舊版 json.dumps vs zlib 壓縮
+# 只計算 value 的位元組數 (不含 Redis 每個 key / list 節點的固定開銷)，並量測上帝模式讀取時的解碼成本。
+#   python bench/bench_admin_storage.py
+
+import json
+import random
+import timeit
+
+import fixtures  # noqa: F401  (把 api/ 加進 sys.path)
+from admin_store import encode_report, decode_report, encode_log_entry, render_log_entry, render_log_entries
+
+STATUSES = ["API(剩:48213)", "Redis", "Mem Cache", "Redis(Stale)", "Resp Cache"]
+ROUTES = [("臺北", "板橋"), ("板橋", "臺北"), ("臺北", "臺中"), ("新竹", "高雄"), ("桃園", "中壢")]
+
+
+def make_log_entries(n=200, seed=3):
+    """依實際比例產生 Log：大多是單一查詢 / 自動更新，少量批次與看板"""
+    rnd = random.Random(seed)
+    t = 1792200000
+    entries = []
+    for _ in range(n):
+        t += rnd.randint(30, 120)
+        kind = rnd.random()
+        v2 = rnd.choice(STATUSES)
+        if kind < 0.85:
+            start, end = rnd.choice(ROUTES)
+            entries.append({"t": t, "a": rnd.choice(["Query", "Refresh", "Refresh(Delta)"]),
+                            "r": [[start, end, rnd.randint(20, 140)]], "v3": rnd.choice(STATUSES), "v2": v2})
+        elif kind < 0.95:
+            entries.append({"t": t, "a": "Batch", "v2": v2,
+                            "r": [[s, e, rnd.randint(20, 140)] for s, e in rnd.sample(ROUTES, 3)]})
+        else:
+            entries.append({"t": t, "a": "Board", "b": "臺北", "h": 3, "n": 30, "v3": rnd.choice(STATUSES), "v2": v2})
+    return entries
+
+
+def make_report(seed=4):
+    rnd = random.Random(seed)
+    logs = [f"[{10 + i // 60:02d}:{i % 60:02d}:{rnd.randint(0, 59):02d}] Fetch OK: 臺北 -> 板橋 ({rnd.randint(80, 900)}ms, "
+            f"{rnd.randint(20, 140)} trains, cache {rnd.choice(['HIT', 'MISS'])})" for i in range(30)]
+    return {
+        "timestamp": "2026/10/17 上午8:12:45",
+        "user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 18_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+                      "Version/18.0 Mobile/15E148 Safari/604.1",
+        "screen": "390x844", "rpm": 3, "total_requests": 57,
+        "diagnostics": {"route_status": "T:Redis / N:Skipped", "delay_status": "Mem Cache",
+                        "cache": {"l1_hit": 2, "l2_hit": 1, "miss": 0, "stale": 0},
+                        "quota": {"remaining": 48213, "level": "normal", "ttl_factor": 1, "deferred": []}},
+        "logs": logs, "user_desc": "(Auto Upload on Open)",
+    }
+
+
+def main():
+    entries = make_log_entries()
+    old_logs = [render_log_entry(encode_log_entry(e)).encode('utf-8') for e in entries]
+    new_logs = [encode_log_entry(e).encode('utf-8') for e in entries]
+    old_sz, new_sz = sum(map(len, old_logs)), sum(map(len, new_logs))
+
+    report = make_report()
+    old_report = json.dumps(report).encode('utf-8')
+    new_report = encode_report(report)
+    assert decode_report(new_report) == report and decode_report(old_report) == report
+
+    n = 200
+    t_old_logs = timeit.timeit(lambda: [l.decode('utf-8') for l in old_logs], number=n) / n * 1000
+    t_new_logs = timeit.timeit(lambda: render_log_entries(new_logs), number=n) / n * 1000
+    t_old_rep = timeit.timeit(lambda: json.loads(old_report), number=n) / n * 1000
+    t_new_rep = timeit.timeit(lambda: decode_report(new_report), number=n) / n * 1000
+
+    print(f"{'':<28}{'old bytes':>11}{'new bytes':>11}{'saved':>8}{'old read ms':>13}{'new read ms':>13}")
+    print(f"{'session log (200 entries)':<28}{old_sz:>11}{new_sz:>11}{1 - new_sz / old_sz:>8.0%}{t_old_logs:>13.3f}{t_new_logs:>13.3f}")
+    print(f"{'  per entry (avg)':<28}{old_sz / len(entries):>11.0f}{new_sz / len(entries):>11.0f}")
+    print(f"{'report':<28}{len(old_report):>11}{len(new_report):>11}{1 - len(new_report) / len(old_report):>8.0%}"
+          f"{t_old_rep:>13.3f}{t_new_rep:>13.3f}")
+
+    # 以 1000 個活躍 session (各 200 筆，TTL 1 天) + sys_logs 100 筆 + 每天 300 份回報 (保留 7 天) 估算
+    old_total = 1000 * old_sz + 100 * old_sz / len(entries) + 300 * 7 * len(old_report)
+    new_total = 1000 * new_sz + 100 * new_sz / len(entries) + 300 * 7 * len(new_report)
+    print(f"\nestimate (1000 sessions, 2100 reports): {old_total / 1e6:.1f} MB -> {new_total / 1e6:.1f} MB "
+          f"({1 - new_total / old_total:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# bench/bench_board.py
+# 車站看板 (board=) 的 CPU 成本：先疊加今天 00:00 ~ 48 小時後的所有離站班次再挑出看板時間窗 (改版前)
+# vs 只疊加看板時間窗 (剛開走 10 分鐘內 ~ hours 小時後) 的班次。以全線 1200 班/日的臺北站量測，並先確認輸出相同。
+#   python bench/bench_board.py [--trains 1200] [--hours 3]
+
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+from fixtures import make_timetables, make_delays
+from snapshot import TW_TZ, PAST_GRACE_SEC, compile_route
+from timetable import build_daily_index, query_departures
+import index
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trains", type=int, default=1200, help="全線每日班次數")
+    ap.add_argument("--hours", type=float, default=3)
+    ap.add_argument("--limit", type=int, default=30)
+    ap.add_argument("-n", type=int, default=300)
+    args = ap.parse_args()
+
+    timetables = make_timetables(args.trains)
+    daily = build_daily_index(timetables)
+    delays = make_delays(timetables)
+    h = index.handler.__new__(index.handler)
+
+    cases = [("01:30", datetime(2026, 10, 17, 1, 30, tzinfo=TW_TZ)),
+             ("08:00", datetime(2026, 10, 17, 8, 0, tzinfo=TW_TZ)),
+             ("22:30", datetime(2026, 10, 17, 22, 30, tzinfo=TW_TZ))]
+
+    print(f"臺北站：全線每日 {args.trains} 班，看板 {args.hours:g} 小時 / 最多 {args.limit} 班，每個情境 {args.n} 次")
+    print(f"  {'':<8}{'departures':>11}{'shown':>7}{'full-day ms':>13}{'window ms':>11}{'speedup':>9}")
+    for name, now_aware in cases:
+        day = lambda offset: (now_aware + timedelta(days=offset)).strftime('%Y-%m-%d')
+        rows = query_departures(daily, "1000")
+        snaps = [compile_route([r[:4] for r in rows], day(0))]
+        if now_aware.hour < 4: snaps.insert(0, compile_route([r[:4] for r in rows], day(-1), True))
+        until_ts = now_aware.timestamp() + args.hours * 3600
+        if (now_aware + timedelta(hours=args.hours)).date() != now_aware.date():
+            snaps.append(compile_route([r[:4] for r in rows], day(1)))
+
+        def full_day():
+            result, _ = h.collect_trains(snaps, delays, now_aware, want_next_day=True)
+            return [p for p in result if not p['is_past'] and p['sort_key'] <= until_ts][:args.limit]
+
+        def windowed():
+            window = (now_aware.timestamp() - PAST_GRACE_SEC, until_ts)
+            result, _ = h.collect_trains(snaps, delays, now_aware, want_next_day=True, window=window)
+            return result[:args.limit]
+
+        shown = windowed()
+        assert full_day() == shown, f"{name}: windowed board differs"
+        t_full = timeit.timeit(full_day, number=args.n) / args.n
+        t_win = timeit.timeit(windowed, number=args.n) / args.n
+        print(f"  {name:<8}{sum(len(s) for s in snaps):>11}{len(shown):>7}{t_full * 1e3:>13.3f}{t_win * 1e3:>11.3f}"
+              f"{t_full / t_win:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench/bench_coldstart.py
+# 冷啟動量測：每次開一個全新的 Python 行程，記錄
+#   import   -> import api/index.py 花的時間 (Vercel 冷啟動時每個 instance 都要付一次)
+#   first    -> 同一個行程處理第一個查詢的時間 (Redis 是空的 MemRedis，TDX 是本地 fake_tdx)
+#
+#   python bench/bench_coldstart.py [-n 10] [--api-dir 其他版本的 api/ 目錄]
+#
+# 比較改版前後：git worktree add /tmp/old <rev> 後用 --api-dir /tmp/old/api (舊版若不支援 TDX_HOST 只量 import)
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from fake_tdx import FakeTDX
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..", "api")
+
+CHILD = r"""
+import json, sys, threading, time, urllib.request
+from urllib.parse import quote
+sys.path[:0] = [sys.argv[1], sys.argv[2]]
+t0 = time.perf_counter()
+import index
+t1 = time.perf_counter()
+result = {"import_ms": (t1 - t0) * 1000, "first_ms": None}
+if sys.argv[3] == "1" and hasattr(index, "now_tw"):
+    from http.server import ThreadingHTTPServer
+    from mem_redis import MemRedis
+    index.redis_client = MemRedis()
+    class Quiet(index.handler):
+        def log_message(self, *args): pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Quiet)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api?start={quote('臺北')}&end={quote('板橋')}"
+    t2 = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as res: res.read()
+    result["first_ms"] = (time.perf_counter() - t2) * 1000
+print(json.dumps(result))
+"""
+
+
+def run_child(api_dir, env, first):
+    out = subprocess.run([sys.executable, "-c", CHILD, os.path.abspath(api_dir), BENCH_DIR, "1" if first else "0"],
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=10)
+    ap.add_argument("--api-dir", default=API_DIR)
+    ap.add_argument("--no-first", action="store_true", help="只量 import")
+    ap.add_argument("--tdx-latency-ms", type=float, default=120.0)
+    args = ap.parse_args()
+
+    tdx = FakeTDX(args.tdx_latency_ms).start()
+    env = dict(os.environ, TDX_HOST=tdx.url, TDX_ID="bench", TDX_SECRET="bench")
+    try:
+        runs = [run_child(args.api_dir, env, not args.no_first) for _ in range(args.n)]
+    finally:
+        tdx.stop()
+
+    print(f"{args.api_dir}  ({args.n} fresh processes)")
+    for field in ("import_ms", "first_ms"):
+        values = [r[field] for r in runs if r[field] is not None]
+        if not values: continue
+        print(f"  {field:<10} median {statistics.median(values):7.1f}  min {min(values):7.1f}  max {max(values):7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# bench/bench_e2e.py
+# 端到端壓測：api/index.py 的 handler 跑在本地 HTTP server 上，
+# TDX 換成 fake_tdx.FakeTDX、Upstash 換成 mem_redis.MemRedis，不需要網路也不會吃到真實額度。
+# 每個情境回報 p50/p95/p99 延遲、平均每次請求打了幾次上游 API、幾趟 Redis round trip。
+#
+#   python bench/bench_e2e.py [-n 200] [-c 4] [--tdx-latency-ms 120] [--redis-rtt-ms 2] [--recordings DIR]
+#
+# 情境：
+#   cold       每次請求前清空 Redis 與行程內快取 (Vercel 冷啟動 + 快取過期)
+#   warm       快取已熱，輪流查詢幾組常見起訖站
+#   late_night 凌晨 02:30，額外查詢昨日時刻表 (跨日班次)
+#   next_day   next_day=1，額外查詢明日時刻表
+
+import argparse
+import os
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import quote
+
+from fake_tdx import FakeTDX
+from mem_redis import MemRedis
+
+ROUTES = [("臺北", "板橋"), ("板橋", "臺北"), ("臺北", "臺中"), ("新竹", "高雄")]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class Bench:
+    def __init__(self, args):
+        self.tdx = FakeTDX(args.tdx_latency_ms, recordings=args.recordings).start()
+        # index 在 import 時就讀環境變數，所以要先設好
+        os.environ['TDX_HOST'] = self.tdx.url
+        os.environ.setdefault('TDX_ID', 'bench')
+        os.environ.setdefault('TDX_SECRET', 'bench')
+        import cache
+        import index
+        self.cache, self.index = cache, index
+        self.redis = MemRedis(args.redis_rtt_ms)
+        index.redis_client = self.redis
+
+        class QuietHandler(index.handler):
+            def log_message(self, *args): pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), QuietHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}/api"
+
+    def close(self):
+        self.server.shutdown()
+        self.tdx.stop()
+
+    def reset(self):
+        self.redis.flushall()
+        self.cache.local_cache.clear()
+        self.index._snapshot_l1.clear()
+        self.index._resp_l1.clear()
+        self.index._daily_index_l1.clear()
+
+    def fetch(self, start, end, next_day=False):
+        url = f"{self.base}?start={quote(start)}&end={quote(end)}&next_day={int(next_day)}&sid=bench"
+        t0 = time.perf_counter()
+        with urllib.request.urlopen(url, timeout=30) as res:
+            res.read()
+            assert res.status == 200, res.status
+        return (time.perf_counter() - t0) * 1000
+
+    def run(self, name, n, concurrency, cold=False, next_day=False, now=None):
+        self.reset()
+        patcher = mock.patch.object(self.index, "now_tw", lambda: now) if now else None
+        if patcher: patcher.start()
+        try:
+            if not cold:
+                for start, end in ROUTES: self.fetch(start, end, next_day)
+            self.tdx.reset_counts()
+            trips_before = self.redis.round_trips
+
+            def one(i):
+                if cold: self.reset()
+                start, end = ROUTES[i % len(ROUTES)]
+                return self.fetch(start, end, next_day)
+
+            # 冷啟動要逐一清空快取，只能單線程跑
+            workers = 1 if cold else concurrency
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(workers) as pool:
+                latencies = list(pool.map(one, range(n)))
+            elapsed = time.perf_counter() - t0
+            time.sleep(0.05)  # 等回應後的延後寫入跑完再計數
+        finally:
+            if patcher: patcher.stop()
+
+        calls = sum(self.tdx.calls.values())
+        trips = self.redis.round_trips - trips_before
+        print(f"{name:<11}{n:>6}{workers:>4}{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+              f"{percentile(latencies, 99):>9.1f}{statistics.mean(latencies):>9.1f}{n / elapsed:>9.1f}"
+              f"{calls / n:>9.2f}{trips / n:>9.1f}   {dict(self.tdx.calls)}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=200, help="每個情境的請求數")
+    ap.add_argument("-c", "--concurrency", type=int, default=4)
+    ap.add_argument("--tdx-latency-ms", type=float, default=120.0)
+    ap.add_argument("--redis-rtt-ms", type=float, default=2.0)
+    ap.add_argument("--recordings", help="錄製的 TDX 回應目錄 (見 fake_tdx.py)")
+    args = ap.parse_args()
+
+    bench = Bench(args)
+    today = bench.index.now_tw()
+    late_night = datetime(today.year, today.month, today.day, 2, 30, tzinfo=today.tzinfo)
+    print(f"TDX latency {args.tdx_latency_ms}ms, Redis RTT {args.redis_rtt_ms}ms")
+    print(f"{'scenario':<11}{'reqs':>6}{'c':>4}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean':>9}{'req/s':>9}"
+          f"{'tdx/req':>9}{'rt/req':>9}   upstream calls")
+    try:
+        bench.run("cold", max(args.n // 10, 10), args.concurrency, cold=True)
+        bench.run("warm", args.n, args.concurrency)
+        bench.run("late_night", args.n, args.concurrency, now=late_night)
+        bench.run("next_day", args.n, args.concurrency, next_day=True)
+    finally:
+        bench.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench/bench_snapshot.py
+# 比較每次請求的 CPU 成本：舊版 process_daily_list (每次重新解析原始時刻表) vs 預編譯快照只疊加誤點
+#   python bench/bench_snapshot.py
+
+import timeit
+from datetime import datetime, timedelta
+
+from fixtures import make_timetables, od_timetables, make_delays
+from snapshot import TW_TZ, compile_route, overlay_delays
+from timetable import normalize_od
+
+
+def legacy_process_daily_list(raw_list, date_str, start_id, end_id, delays, now_aware, fix_crossing_night=False):
+    """改版前 handler.process_daily_list 原樣保留，作為比較基準"""
+    processed = []
+    for item in raw_list:
+        info = item.get('TrainInfo', {})
+        no = info.get('TrainNo')
+        raw_type = info.get('TrainTypeName', {}).get('Zh_tw', '')
+        stop_times = item.get('StopTimes', [])
+        dep_time, arr_time = None, None
+        for stop in stop_times:
+            s_id = stop.get('StationID')
+            if s_id == start_id: dep_time = stop.get('DepartureTime')
+            elif s_id == end_id: arr_time = stop.get('ArrivalTime')
+        if not dep_time or not arr_time: continue
+
+        display_type = raw_type
+        type_color = "#ffffff"
+        if "區間快" in raw_type: display_type, type_color = "區間快", "#0076B2"
+        elif "區間" in raw_type: display_type, type_color = "區間車", "#0076B2"
+        elif "普悠瑪" in raw_type: display_type, type_color = "普悠瑪", "#9C1637"
+        elif "3000" in raw_type: display_type, type_color = "自強3000", "#ffffff"
+        elif "自強" in raw_type: display_type, type_color = "自強號", "#DF3F1F"
+        elif "太魯閣" in raw_type: display_type, type_color = "太魯閣", "#9C1637"
+        elif "莒光" in raw_type: display_type, type_color = "莒光號", "#FF8C00"
+
+        raw_delay = int(delays.get(no, 0))
+        dep_dt = datetime.strptime(f"{date_str} {dep_time}", "%Y-%m-%d %H:%M").replace(tzinfo=TW_TZ)
+        arr_dt = datetime.strptime(f"{date_str} {arr_time}", "%Y-%m-%d %H:%M").replace(tzinfo=TW_TZ)
+
+        if fix_crossing_night:
+            if dep_time < "12:00": dep_dt += timedelta(days=1)
+            if arr_time < "12:00": arr_dt += timedelta(days=1)
+
+        if arr_dt < dep_dt: arr_dt += timedelta(days=1)
+        time_diff_seconds = (dep_dt - now_aware).total_seconds()
+
+        if time_diff_seconds > 21600: delay = 0
+        else: delay = raw_delay
+
+        real_dep = dep_dt + timedelta(minutes=delay)
+        real_arr = arr_dt + timedelta(minutes=delay)
+        is_past = real_dep < (now_aware - timedelta(minutes=10))
+
+        processed.append({
+            "no": no, "type": display_type, "delay": delay, "color": type_color,
+            "act_dep": real_dep.strftime("%H:%M"), "act_arr": real_arr.strftime("%H:%M"),
+            "dep_date": real_dep.strftime("%Y-%m-%d"), "arr_date": real_arr.strftime("%Y-%m-%d"),
+            "sch_dep": dep_time, "sch_arr": arr_time, "sort_key": real_dep.timestamp(), "is_past": is_past
+        })
+    return processed
+
+
+def main():
+    timetables = make_timetables()
+    raw_list = od_timetables(timetables, "1000", "1020")  # 臺北 -> 板橋
+    delays = make_delays(timetables)
+    date_str = "2026-10-17"
+    now_aware = datetime(2026, 10, 17, 17, 30, tzinfo=TW_TZ)
+
+    # 先確認輸出一致
+    for fix in (False, True):
+        old = legacy_process_daily_list(raw_list, date_str, "1000", "1020", delays, now_aware, fix)
+        snap = compile_route(normalize_od(raw_list, "1000", "1020"), date_str, fix)
+        new = overlay_delays(snap, delays, now_aware.timestamp())
+        key = lambda x: (x["sort_key"], x["no"])
+        assert sorted(old, key=key) == sorted(new, key=key), "snapshot output differs from legacy output"
+
+    snap = compile_route(normalize_od(raw_list, "1000", "1020"), date_str)
+    n = 200
+    t_old = timeit.timeit(lambda: legacy_process_daily_list(raw_list, date_str, "1000", "1020", delays, now_aware), number=n) / n
+    t_compile = timeit.timeit(lambda: compile_route(normalize_od(raw_list, "1000", "1020"), date_str), number=n) / n
+    t_new = timeit.timeit(lambda: overlay_delays(snap, delays, now_aware.timestamp()), number=n) / n
+
+    print(f"臺北 -> 板橋：{len(snap)} 班 (原始 TrainTimetables {len(raw_list)} 筆)")
+    print(f"  legacy process_daily_list : {t_old * 1e3:8.3f} ms / request")
+    print(f"  normalize + compile (一次): {t_compile * 1e3:8.3f} ms / (route, date)")
+    print(f"  overlay_delays            : {t_new * 1e3:8.3f} ms / request  ({t_old / t_new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# bench/bench_storage.py
+# 時刻表快取格式遷移報告：每個 Redis key 的位元組數與每次命中的解碼時間
+#   舊版：json.dumps(整包 TrainTimetables)        (v3_route_* 舊格式)
+#   新版：swr 信封 + encode_route_rows 精簡二進位   (v3_route_* 新格式，舊值會被當成 miss)
+#   python bench/bench_storage.py
+
+import json
+import timeit
+
+from fixtures import make_timetables, od_timetables
+from cache import _encode_envelope, _decode_envelope
+from timetable import normalize_od, encode_route_rows, decode_route_rows
+
+PAIRS = [("1000", "1020", "臺北 -> 板橋"), ("1020", "1000", "板橋 -> 臺北"),
+         ("1000", "3300", "臺北 -> 臺中"), ("1210", "4400", "新竹 -> 高雄")]
+
+
+def main():
+    timetables = make_timetables()
+    n = 200
+    total_old = total_new = 0
+    print(f"{'route':<14}{'trains':>7}{'old bytes':>11}{'new bytes':>11}{'ratio':>8}{'old decode':>13}{'new decode':>13}")
+    for start_id, end_id, label in PAIRS:
+        raw_list = od_timetables(timetables, start_id, end_id)
+        old_blob = json.dumps(raw_list).encode('utf-8')
+        rows = normalize_od(raw_list, start_id, end_id)
+        new_blob = _encode_envelope(encode_route_rows(rows), 0, 0)
+
+        assert decode_route_rows(_decode_envelope(new_blob)[0]) == rows
+        assert decode_route_rows(old_blob) is None  # 舊格式會被忽略
+
+        t_old = timeit.timeit(lambda: json.loads(old_blob), number=n) / n
+        t_new = timeit.timeit(lambda: decode_route_rows(_decode_envelope(new_blob)[0]), number=n) / n
+        total_old += len(old_blob)
+        total_new += len(new_blob)
+        print(f"{label:<12}{len(rows):>7}{len(old_blob):>11}{len(new_blob):>11}{len(old_blob) / len(new_blob):>7.1f}x"
+              f"{t_old * 1e3:>10.3f} ms{t_new * 1e3:>10.3f} ms")
+    print(f"total: {total_old} -> {total_new} bytes ({100 * (1 - total_new / total_old):.1f}% saved)")
+
+
+if __name__ == "__main__":
+    main()
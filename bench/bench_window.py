@@ -0,0 +1,72 @@
+# bench/bench_window.py
+# 時間窗選取的 CPU 成本：舊版 collect_trains (整份疊加誤點 -> 字串 key 去重 dict -> 逐筆過濾 -> 全部重新排序)
+# vs 目前的 handler.collect_trains (只有超出時間窗的清單才用 bisect 切、清單有重疊才去重、tuple key、一次排序)。
+# 以繁忙的 臺北 -> 板橋、昨日 / 今日 / 明日三份清單、48 小時窗量測，並先確認兩者輸出完全相同。
+#   python bench/bench_window.py [--trains 500]
+
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+from fixtures import make_timetables, od_timetables, make_delays
+from snapshot import TW_TZ, compile_route, overlay_delays
+from timetable import normalize_od
+import index
+
+
+def legacy_collect(snaps, delays, now_aware, want_next_day):
+    """改版前 handler.collect_trains 原樣保留，作為比較基準"""
+    processed = []
+    for snap in snaps:
+        if snap: processed.extend(overlay_delays(snap, delays, now_aware.timestamp()))
+
+    unique_dict = {f"{p['sort_key']}_{p['no']}": p for p in processed}
+    final_result = []
+    now_ts = now_aware.timestamp()
+    past_limit = now_aware.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    future_limit = now_ts + (48 if want_next_day else 24) * 3600
+    for p in unique_dict.values():
+        if past_limit <= p['sort_key'] <= future_limit: final_result.append(p)
+    return sorted(final_result, key=lambda x: x['sort_key'])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trains", type=int, default=500, help="全線每日班次數")
+    ap.add_argument("-n", type=int, default=300)
+    args = ap.parse_args()
+
+    timetables = make_timetables(args.trains)
+    rows = normalize_od(od_timetables(timetables, "1000", "1020"), "1000", "1020")  # 臺北 -> 板橋
+    delays = make_delays(timetables)
+    # 大誤點 (含提早) 也要跟舊版一致
+    delays.update({"120": 95, "121": -3})
+
+    # (名稱, 現在時間, 是否載入明日)；凌晨 4 點前另外帶上昨日跨夜清單
+    cases = [("01:30 yest+today+tmrw", datetime(2026, 10, 17, 1, 30, tzinfo=TW_TZ), True),
+             ("17:30 today+tmrw", datetime(2026, 10, 17, 17, 30, tzinfo=TW_TZ), True),
+             ("17:30 today", datetime(2026, 10, 17, 17, 30, tzinfo=TW_TZ), False)]
+
+    # collect_trains 不需要請求狀態，借用 handler 的方法即可 (同 warmup.py)
+    h = index.handler.__new__(index.handler)
+    window_collect = h.collect_trains
+
+    print(f"臺北 -> 板橋：每日 {len(rows)} 班，每個情境 {args.n} 次")
+    print(f"  {'':<24}{'trains':>7}{'legacy ms':>11}{'window ms':>11}{'speedup':>9}")
+    for name, now_aware, want_next_day in cases:
+        day = lambda offset: (now_aware + timedelta(days=offset)).strftime('%Y-%m-%d')
+        snaps = (compile_route(rows, day(-1), True) if now_aware.hour < 4 else None,
+                 compile_route(rows, day(0)),
+                 compile_route(rows, day(1)) if want_next_day else None)
+
+        old = legacy_collect(snaps, delays, now_aware, want_next_day)
+        new, _ = window_collect(snaps, delays, now_aware, want_next_day)
+        assert old == new, f"{name}: window output differs from legacy output"
+
+        t_old = timeit.timeit(lambda: legacy_collect(snaps, delays, now_aware, want_next_day), number=args.n) / args.n
+        t_new = timeit.timeit(lambda: window_collect(snaps, delays, now_aware, want_next_day), number=args.n) / args.n
+        print(f"  {name:<24}{len(new):>7}{t_old * 1e3:>11.3f}{t_new * 1e3:>11.3f}{t_old / t_new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# bench/fake_tdx.py
+# 本地假 TDX 伺服器：回放錄製好的 (或 fixtures 產生的) 時刻表與誤點資料，
+# 可設定回應延遲，並回傳逐次遞減的剩餘額度 header。
+#
+#   python bench/fake_tdx.py --port 8900 --latency-ms 120 [--recordings DIR]
+#
+# DIR 底下可放錄製的 TDX 回應 (檔名對應 URL 路徑最後幾段)：
+#   LiveTrainDelay.json / TrainDate.json / OD_{起站}_{迄站}.json
+# 沒有的就用 fixtures 產生的西部幹線假資料。
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixtures import make_timetables, od_timetables, make_delays
+
+
+class FakeTDX:
+    def __init__(self, latency_ms=100.0, quota=50000, recordings=None, host="127.0.0.1", port=0):
+        self.latency = latency_ms / 1000.0
+        self.quota = quota
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.recordings = recordings
+        self.timetables = self._load("TrainDate.json", "TrainTimetables") or make_timetables()
+        delays = self._load("LiveTrainDelay.json", "LiveTrainDelay")
+        self.delays = delays or [{"TrainNo": no, "DelayTime": d} for no, d in make_delays(self.timetables).items()]
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self._lock: self.calls.clear()
+
+    def _load(self, name, field):
+        if not self.recordings: return None
+        path = os.path.join(self.recordings, name)
+        if not os.path.exists(path): return None
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data.get(field, []) if isinstance(data, dict) else data
+
+    def _route(self, method, path):
+        """回傳 (計數名稱, status, payload)"""
+        if method == "POST" and path.endswith("/openid-connect/token"):
+            return ("token", 200, {"access_token": "bench-token", "expires_in": 86400})
+        if path.endswith("/v2/Rail/TRA/LiveTrainDelay"):
+            return ("LiveTrainDelay", 200, {"LiveTrainDelay": self.delays})
+        m = re.search(r"/v3/Rail/TRA/DailyTrainTimetable/OD/(\w+)/to/(\w+)/([\d-]+)$", path)
+        if m:
+            s, e = m.group(1), m.group(2)
+            recorded = self._load(f"OD_{s}_{e}.json", "TrainTimetables")
+            return ("OD", 200, {"TrainTimetables": recorded if recorded is not None else od_timetables(self.timetables, s, e)})
+        if re.search(r"/v3/Rail/TRA/DailyTrainTimetable/TrainDate/[\d-]+$", path):
+            return ("TrainDate", 200, {"TrainTimetables": self.timetables})
+        return ("unknown", 404, {"message": "not found"})
+
+    def _make_handler(self):
+        tdx = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length: self.rfile.read(length)
+                name, status, payload = tdx._route(method, self.path.split("?")[0])
+                with tdx._lock:
+                    tdx.calls[name] += 1
+                    if name != "token": tdx.quota -= 1
+                    remaining = tdx.quota
+                if tdx.latency: time.sleep(tdx.latency)
+                if remaining < 0: status, payload = 429, {"message": "API rate limit exceeded"}
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-RateLimit-Remaining', str(max(remaining, 0)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self): self._serve("GET")
+            def do_POST(self): self._serve("POST")
+            def log_message(self, *args): pass
+
+        return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--latency-ms", type=float, default=100.0)
+    ap.add_argument("--quota", type=int, default=50000)
+    ap.add_argument("--recordings")
+    args = ap.parse_args()
+    tdx = FakeTDX(args.latency_ms, args.quota, args.recordings, port=args.port)
+    print(f"Fake TDX listening on {tdx.url}  (TDX_HOST={tdx.url})")
+    tdx.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
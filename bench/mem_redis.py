@@ -0,0 +1,243 @@
+# bench/mem_redis.py
+# 行程內的 Redis 替身：只實作 api/ 用到的指令，並計算 round trip 次數
+# (一般指令一次算一趟，pipeline 整批 execute 算一趟)，可加上模擬的網路延遲。
+
+import fnmatch
+import threading
+import time
+
+
+class MemRedis:
+    def __init__(self, rtt_ms=0.0):
+        self.rtt = rtt_ms / 1000.0
+        self.round_trips = 0
+        self._data = {}
+        self._expire = {}
+        self._lock = threading.RLock()
+
+    # ---------- 內部工具 ----------
+    def _trip(self):
+        with self._lock: self.round_trips += 1
+        if self.rtt: time.sleep(self.rtt)
+
+    def _alive(self, key):
+        exp = self._expire.get(key)
+        if exp is not None and exp <= time.time():
+            self._data.pop(key, None)
+            self._expire.pop(key, None)
+        return key in self._data
+
+    @staticmethod
+    def _k(key):
+        return key.encode('utf-8') if isinstance(key, str) else key
+
+    @staticmethod
+    def _v(val):
+        if isinstance(val, bytes): return val
+        if isinstance(val, str): return val.encode('utf-8')
+        return str(val).encode('utf-8')
+
+    def _exec(self, name, *args, **kwargs):
+        with self._lock:
+            return getattr(self, "_cmd_" + name)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_"): raise AttributeError(name)
+        if not hasattr(type(self), "_cmd_" + name): raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self._trip()
+            return self._exec(name, *args, **kwargs)
+        return call
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expire.clear()
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+    def scan_iter(self, match="*", count=None):
+        self._trip()
+        with self._lock:
+            keys = [k for k in list(self._data) if self._alive(k) and fnmatch.fnmatchcase(k.decode('utf-8'), match)]
+        return iter(keys)
+
+    # ---------- 字串 ----------
+    def _cmd_ping(self):
+        return True
+
+    def _cmd_get(self, key):
+        key = self._k(key)
+        return self._data.get(key) if self._alive(key) else None
+
+    def _cmd_set(self, key, val, ex=None, px=None, nx=False):
+        key = self._k(key)
+        if nx and self._alive(key): return None
+        self._data[key] = self._v(val)
+        self._expire.pop(key, None)
+        if ex: self._expire[key] = time.time() + ex
+        if px: self._expire[key] = time.time() + px / 1000.0
+        return True
+
+    def _cmd_incr(self, key, amount=1):
+        key = self._k(key)
+        val = int(self._data.get(key, b"0")) + amount if self._alive(key) else amount
+        self._data[key] = self._v(val)
+        return val
+
+    def _cmd_delete(self, *keys):
+        n = 0
+        for key in map(self._k, keys):
+            if self._alive(key):
+                del self._data[key]
+                self._expire.pop(key, None)
+                n += 1
+        return n
+
+    _cmd_unlink = _cmd_delete
+
+    def _cmd_expire(self, key, seconds):
+        key = self._k(key)
+        if not self._alive(key): return False
+        self._expire[key] = time.time() + seconds
+        return True
+
+    def _cmd_ttl(self, key):
+        key = self._k(key)
+        if not self._alive(key): return -2
+        exp = self._expire.get(key)
+        return -1 if exp is None else int(round(exp - time.time()))
+
+    def _cmd_eval(self, script, numkeys, *args):
+        # api/ 只用到「值相符才刪除」的租約釋放腳本
+        key, token = self._k(args[0]), self._v(args[1])
+        if self._cmd_get(key) == token: return self._cmd_delete(key)
+        return 0
+
+    # ---------- hash ----------
+    def _hash(self, key, create=False):
+        key = self._k(key)
+        if not self._alive(key):
+            if not create: return {}
+            self._data[key] = {}
+        return self._data[key]
+
+    def _cmd_hincrby(self, key, field, amount=1):
+        h = self._hash(key, create=True)
+        field = self._k(field)
+        h[field] = self._v(int(h.get(field, b"0")) + amount)
+        return int(h[field])
+
+    def _cmd_hset(self, key, field=None, value=None, mapping=None):
+        h = self._hash(key, create=True)
+        items = dict(mapping or {})
+        if field is not None: items[field] = value
+        added = sum(1 for f in items if self._k(f) not in h)
+        for f, v in items.items(): h[self._k(f)] = self._v(v)
+        return added
+
+    def _cmd_hgetall(self, key):
+        return dict(self._hash(key))
+
+    # ---------- list ----------
+    def _list(self, key, create=False):
+        key = self._k(key)
+        if not self._alive(key):
+            if not create: return []
+            self._data[key] = []
+        return self._data[key]
+
+    def _cmd_lpush(self, key, *vals):
+        lst = self._list(key, create=True)
+        for v in vals: lst.insert(0, self._v(v))
+        return len(lst)
+
+    def _cmd_ltrim(self, key, start, end):
+        lst = self._list(key)
+        lst[:] = lst[start:(end + 1 if end != -1 else None)]
+        return True
+
+    def _cmd_lrange(self, key, start, end):
+        return list(self._list(key)[start:(end + 1 if end != -1 else None)])
+
+    def _cmd_llen(self, key):
+        return len(self._list(key))
+
+    # ---------- sorted set ----------
+    def _zset(self, key, create=False):
+        return self._hash(key, create)
+
+    def _cmd_zadd(self, key, mapping):
+        z = self._zset(key, create=True)
+        added = 0
+        for m, score in mapping.items():
+            m = self._k(m)
+            if m not in z: added += 1
+            z[m] = float(score)
+        return added
+
+    def _cmd_zincrby(self, key, amount, member):
+        z = self._zset(key, create=True)
+        m = self._k(member)
+        z[m] = z.get(m, 0.0) + amount
+        return z[m]
+
+    def _cmd_zrem(self, key, *members):
+        z = self._zset(key)
+        return sum(1 for m in map(self._k, members) if z.pop(m, None) is not None)
+
+    @staticmethod
+    def _bound(b):
+        if isinstance(b, bytes): b = b.decode()
+        b = str(b)
+        if b in ("+inf", "inf"): return (float("inf"), False)
+        if b == "-inf": return (float("-inf"), False)
+        if b.startswith("("): return (float(b[1:]), True)
+        return (float(b), False)
+
+    def _in_range(self, score, lo, hi):
+        (lo_v, lo_x), (hi_v, hi_x) = self._bound(lo), self._bound(hi)
+        return (score > lo_v if lo_x else score >= lo_v) and (score < hi_v if hi_x else score <= hi_v)
+
+    def _cmd_zremrangebyscore(self, key, lo, hi):
+        z = self._zset(key)
+        drop = [m for m, s in z.items() if self._in_range(s, lo, hi)]
+        for m in drop: del z[m]
+        return len(drop)
+
+    def _cmd_zrevrangebyscore(self, key, hi, lo, start=None, num=None, withscores=False):
+        z = self._zset(key)
+        items = sorted(((m, s) for m, s in z.items() if self._in_range(s, lo, hi)), key=lambda x: (x[1], x[0]), reverse=True)
+        if start is not None: items = items[start:start + num]
+        return items if withscores else [m for m, _ in items]
+
+    def _cmd_zrevrange(self, key, start, end, withscores=False):
+        items = sorted(self._zset(key).items(), key=lambda x: (x[1], x[0]), reverse=True)
+        items = items[start:(end + 1 if end != -1 else None)]
+        return items if withscores else [m for m, _ in items]
+
+    def _cmd_zcard(self, key):
+        return len(self._zset(key))
+
+
+class _Pipeline:
+    def __init__(self, r):
+        self._r = r
+        self._ops = []
+
+    def __getattr__(self, name):
+        if not hasattr(MemRedis, "_cmd_" + name): raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self._ops.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        self._r._trip()
+        with self._r._lock:
+            results = [self._r._exec(name, *args, **kwargs) for name, args, kwargs in self._ops]
+        self._ops = []
+        return results
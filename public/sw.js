@@ -1,4 +1,59 @@
+// 前端殼 (index.html / manifest / icon) 預先快取，網路優先、離線時用快取；
+// 時刻表包 (/api/index?bundle=...&date=...) 整天不變：快取優先，只保留當天的版本。
+// 其他 API (查詢、誤點) 一律走網路。
+const SHELL_CACHE = 'tl-shell-v1';
+const BUNDLE_CACHE = 'tl-bundle-v1';
+const SHELL_URLS = ['/', '/manifest.json', '/icon.png'];
+
 self.addEventListener('install', (event) => {
-  self.skipWaiting();
+    event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(SHELL_URLS)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.filter(k => k !== SHELL_CACHE && k !== BUNDLE_CACHE).map(k => caches.delete(k))))
+        .then(() => self.clients.claim()));
+});
+
+async function bundleFirst(request) {
+    const cache = await caches.open(BUNDLE_CACHE);
+    const hit = await cache.match(request);
+    if (hit) return hit;
+    const res = await fetch(request);
+    // 缺了某一天的包伺服器只給 5 分鐘快取，不留在 service worker 裡
+    const maxAge = parseInt(((res.headers.get('Cache-Control') || '').match(/max-age=(\d+)/) || [])[1] || '0');
+    if (res.ok && maxAge >= 3600) {
+        // 換日或常用路線變了就是新網址，舊日期的包順手清掉
+        const date = new URL(request.url).searchParams.get('date');
+        for (const old of await cache.keys()) {
+            if (new URL(old.url).searchParams.get('date') !== date) await cache.delete(old);
+        }
+        await cache.put(request, res.clone());
+    }
+    return res;
+}
+
+async function networkFirst(request) {
+    const cache = await caches.open(SHELL_CACHE);
+    try {
+        const res = await fetch(request);
+        if (res.ok) await cache.put(request, res.clone());
+        return res;
+    } catch (err) {
+        const hit = await cache.match(request, { ignoreSearch: true });
+        if (hit) return hit;
+        throw err;
+    }
+}
+
+self.addEventListener('fetch', (event) => {
+    const req = event.request;
+    if (req.method !== 'GET') return;
+    const url = new URL(req.url);
+    if (url.origin !== self.location.origin) return;
+    if (url.pathname.startsWith('/api')) {
+        if (url.searchParams.has('bundle') && url.searchParams.has('date')) event.respondWith(bundleFirst(req));
+        return;
+    }
+    if (req.mode === 'navigate' || SHELL_URLS.includes(url.pathname)) event.respondWith(networkFirst(req));
 });
-self.addEventListener('fetch', (event) => {});
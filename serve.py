@@ -0,0 +1,112 @@
+# serve.py
+# 自架模式：不經過 Vercel，直接用固定大小的 worker pool 跑 api/index.py 的 handler，
+# 同時提供 public/ 底下的前端靜態檔。Redis 連線池與 TDX HTTP session 都是第一次用到才建立，之後所有請求共用。
+#
+#   python serve.py --port 8000 --workers 16
+#
+# 環境變數同 Vercel (TDX_ID / TDX_SECRET / UPSTASH_REDIS_* / ADMIN_*)。
+
+import argparse
+import mimetypes
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PUBLIC_DIR = os.path.join(ROOT, "public")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+_t0 = time.perf_counter()
+import index  # noqa: E402
+IMPORT_MS = (time.perf_counter() - _t0) * 1000
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    每個連線交給固定大小的 thread pool 處理 (ThreadingHTTPServer 是每個連線開一條新執行緒，沒有上限)。
+    處理中 + 排隊中的連線數超過 max_pending 時，accept 迴圈會停下來等，多的連線留在 listen backlog。
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, address, handler_class, workers=16, max_pending=None, backlog=128):
+        self.request_queue_size = backlog
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._slots = threading.BoundedSemaphore(max_pending or workers * 4)
+        super().__init__(address, handler_class)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except RuntimeError:
+            # pool 已關閉 (正在停機)
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+class AppHandler(index.handler):
+    """/api/* 交給原本的 handler (同 vercel.json 的 rewrite)，其餘路徑回傳 public/ 的靜態檔"""
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/api/") or path == "/api": return super().do_GET()
+        self.send_static(path)
+
+    def do_POST(self):
+        if self.path.startswith("/api"): return super().do_POST()
+        self.send_error(404)
+
+    def send_static(self, path):
+        rel = "index.html" if path in ("", "/") else path.lstrip("/")
+        full = os.path.realpath(os.path.join(PUBLIC_DIR, rel))
+        if not full.startswith(os.path.realpath(PUBLIC_DIR) + os.sep) or not os.path.isfile(full):
+            return self.send_error(404)
+        with open(full, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(full)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve the API handler and public/ on a pooled HTTP server")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8000')))
+    ap.add_argument("--workers", type=int, default=16, help="同時處理的請求數上限")
+    ap.add_argument("--max-pending", type=int, help="處理中 + 排隊中的連線上限 (預設 workers x 4)")
+    ap.add_argument("--backlog", type=int, default=128)
+    args = ap.parse_args()
+
+    # 上游 pool 只跑真的要打 TDX 的工作 (快取命中在請求執行緒內就做完)，大小跟 HTTP worker 數一致
+    index.upstream.set_pool_size(args.workers)
+    server = PooledHTTPServer((args.host, args.port), AppHandler, args.workers, args.max_pending, args.backlog)
+    print(f"Serving on http://{args.host}:{args.port} (workers={args.workers}, import {IMPORT_MS:.0f}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
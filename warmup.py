@@ -0,0 +1,38 @@
+# warmup.py
+# 夜間預熱：把最近 7 天最熱門的起訖站「下一個營運日」的時刻表先抓進 Redis，早上第一位使用者不用等 TDX。
+# 凌晨 4 點前執行預熱當天、之後執行預熱明天 (Redis 裡的時刻表 12 小時後就要同步重抓，太早抓的撐不到尖峰)。
+# 環境變數同 api/index.py (TDX_ID / TDX_SECRET / UPSTASH_REDIS_*)，可放進 cron：
+#
+#   30 1 * * *  cd /path/to/repo && python warmup.py --top 30 --budget 40
+#
+# 這個行程跑完就結束，只寫 Redis，不編譯路線快照 (各 instance 第一次查詢時自己從 Redis 編譯)。
+#
+# 部署在 Vercel 時也可以改打上帝模式 API：/api/index?debug=godmode&action=warmup&top=30&budget=40&u=..&p=..
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+
+import index  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prefetch the next service day's timetables for the most queried routes")
+    ap.add_argument("--top", type=int, default=index.WARMUP_TOP_N, help="熱門路線取前幾名")
+    ap.add_argument("--budget", type=int, default=index.WARMUP_BUDGET, help="最多打幾次 TDX")
+    ap.add_argument("--date", help="YYYY-MM-DD，預設下一個營運日 (凌晨 4 點前為今天，之後為明天)")
+    args = ap.parse_args()
+
+    if not index.redis_client: sys.exit("No Redis")
+    # handler 平常由 HTTP server 建立；這裡不經過 socket，只借用它的快取 / 抓取方法
+    h = index.handler.__new__(index.handler)
+    h.init_request_state()
+    result = h.warm_routes(args.top, args.budget, args.date, compile_snapshots=False)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()